@@ -0,0 +1,145 @@
+from typing import Any, Dict, List, Optional, TextIO
+import os
+import json
+import asyncio
+import threading
+from datetime import datetime
+from loguru import logger
+from .metrics import ACTIVITY_LOG_DROPPED
+
+DROP_POLICIES = ("drop_newest", "drop_oldest")
+
+
+class ActivityLogWriter:
+    """
+    背景批次寫入使用者活動記錄
+
+    請求處理只把記錄放入記憶體佇列，不等待磁碟 I/O；單一背景工作累積到
+    batch_size 筆或經過 flush_interval 秒後一次寫入。檔案保持開啟，日期
+    變更時切換到新的檔案。佇列已滿時依 drop_policy 丟棄記錄。
+    """
+
+    def __init__(
+        self,
+        log_dir: str = "logs",
+        prefix: str = "user_activity",
+        max_queue: int = 10000,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+        drop_policy: str = "drop_newest"
+    ):
+        """
+        初始化活動記錄寫入器
+
+        Args:
+            log_dir: 記錄目錄
+            prefix: 檔名前綴，檔名為 {prefix}_{YYYY-MM-DD}.log
+            max_queue: 佇列上限
+            batch_size: 每次寫入的最多筆數
+            flush_interval: 最長的寫入間隔（秒）
+            drop_policy: 佇列已滿時丟棄最新（drop_newest）或最舊（drop_oldest）的記錄
+        """
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"不支援的丟棄策略：{drop_policy}（可用：{', '.join(DROP_POLICIES)}）")
+        self.log_dir = log_dir
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self._file: Optional[TextIO] = None
+        self._file_date: Optional[str] = None
+        self._file_lock = threading.Lock()
+        self._pending: List[Dict[str, Any]] = []  # 已取出佇列、尚未寫入的記錄
+
+    def start(self) -> None:
+        """在目前的事件迴圈中啟動背景寫入工作"""
+        if self._task is None:
+            os.makedirs(self.log_dir, exist_ok=True)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def log(self, entry: Dict[str, Any]) -> None:
+        """
+        放入一筆記錄，不會阻塞
+
+        Args:
+            entry: 可序列化為 JSON 的記錄
+        """
+        try:
+            self._queue.put_nowait(entry)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.drop_policy == "drop_oldest":
+            try:
+                self._queue.get_nowait()
+                self._queue.put_nowait(entry)
+            except (asyncio.QueueEmpty, asyncio.QueueFull):
+                pass
+        self.dropped += 1
+        ACTIVITY_LOG_DROPPED.inc()
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            logger.warning(f"活動記錄佇列已滿，已丟棄 {self.dropped} 筆記錄")
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def _collect(self) -> None:
+        """等待第一筆記錄，再在 flush_interval 內盡量收集到 batch_size 筆"""
+        self._pending.append(await self._queue.get())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(self._pending) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                self._pending.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+    async def _run(self) -> None:
+        while True:
+            await self._collect()
+            batch, self._pending = self._pending, []
+            await self._write_batch(batch)
+
+    async def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        lines = "".join(json.dumps(entry, ensure_ascii=False, default=str) + "\n" for entry in batch)
+        try:
+            await asyncio.to_thread(self._write, lines)
+        except Exception as e:
+            logger.error(f"寫入活動記錄失敗（{len(batch)} 筆）：{str(e)}")
+
+    def _write(self, lines: str) -> None:
+        """在執行緒中寫入並 flush，日期變更時切換檔案"""
+        today = datetime.now().strftime("%Y-%m-%d")
+        with self._file_lock:
+            if self._file is None or self._file_date != today:
+                if self._file is not None:
+                    self._file.close()
+                self._file = open(os.path.join(self.log_dir, f"{self.prefix}_{today}.log"), "a", encoding="utf-8")
+                self._file_date = today
+            self._file.write(lines)
+            self._file.flush()
+
+    async def stop(self) -> None:
+        """停止背景工作，寫入佇列中剩餘的記錄並關閉檔案"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        remaining, self._pending = self._pending, []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        if remaining:
+            await self._write_batch(remaining)
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,186 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+import numpy as np
+from loguru import logger
+
+
+@dataclass
+class _CacheEntry:
+    """單筆快取的答案"""
+
+    threshold: float
+    embedding: Optional[np.ndarray]
+    result: Dict[str, Any]
+    created_at: float
+
+
+class AnswerCache:
+    """
+    查詢答案快取
+
+    完全相同的問題以正規化後的文字為鍵直接命中；相近的問題則比對過去查詢的
+    嵌入向量，餘弦相似度達到門檻即視為命中。引用的來源重新索引時相關項目會失效，
+    另以 TTL 與 LRU 限制快取大小。
+    """
+
+    _PUNCTUATION = re.compile(r"[\s　。，、！？；：「」『』（）()?!.,;:'\"]+")
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 3600, similarity_cutoff: float = 0.95):
+        """
+        初始化答案快取
+
+        Args:
+            max_entries: 最多保留的答案數
+            ttl_seconds: 答案的存活時間（秒）
+            similarity_cutoff: 相近問題的餘弦相似度門檻
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_cutoff = similarity_cutoff
+        self._entries: "OrderedDict[Tuple[str, float], _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 相近問題比對用的向量矩陣，項目變動時重建
+        self._index_keys: List[Tuple[str, float]] = []
+        self._index_matrix: Optional[np.ndarray] = None
+        # 每次失效時遞增；查詢開始後來源有更新時不寫入該次的答案
+        self.generation = 0
+
+    @classmethod
+    def normalize(cls, query_text: str) -> str:
+        """正規化查詢文字：統一全半形、忽略大小寫、空白與標點"""
+        text = unicodedata.normalize("NFKC", query_text).lower()
+        return cls._PUNCTUATION.sub("", text)
+
+    def _key(self, query_text: str, threshold: float) -> Tuple[str, float]:
+        return self.normalize(query_text), round(threshold, 4)
+
+    def _is_expired(self, entry: _CacheEntry) -> bool:
+        return time.time() - entry.created_at > self.ttl_seconds
+
+    def _remove(self, key: Tuple[str, float]) -> None:
+        del self._entries[key]
+        self._index_matrix = None
+
+    def get(self, query_text: str, threshold: float) -> Optional[Dict[str, Any]]:
+        """
+        以正規化文字查詢完全相同的問題
+
+        Args:
+            query_text: 查詢文字
+            threshold: 相似度閾值（不同閾值的答案分開快取）
+
+        Returns:
+            快取的查詢結果，未命中時回傳 None
+        """
+        key = self._key(query_text, threshold)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._is_expired(entry):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return dict(entry.result)
+
+    def get_similar(self, embedding: List[float], threshold: float) -> Optional[Dict[str, Any]]:
+        """
+        查詢與過去問題嵌入相近的答案
+
+        Args:
+            embedding: 正規化的查詢嵌入
+            threshold: 相似度閾值
+
+        Returns:
+            快取的查詢結果，未命中時回傳 None
+        """
+        threshold = round(threshold, 4)
+        with self._lock:
+            if self._index_matrix is None:
+                self._index_keys = [key for key, entry in self._entries.items() if entry.embedding is not None]
+                if not self._index_keys:
+                    return None
+                self._index_matrix = np.vstack([self._entries[key].embedding for key in self._index_keys])
+
+            scores = self._index_matrix @ np.asarray(embedding, dtype=np.float32)
+            for i in np.argsort(-scores):
+                if scores[i] < self.similarity_cutoff:
+                    break
+                key = self._index_keys[i]
+                entry = self._entries[key]
+                if entry.threshold != threshold or self._is_expired(entry):
+                    continue
+                self._entries.move_to_end(key)
+                logger.info(f"相近問題命中答案快取（相似度：{scores[i]:.4f}）")
+                return dict(entry.result)
+        return None
+
+    def put(
+        self,
+        query_text: str,
+        threshold: float,
+        embedding: Optional[List[float]],
+        result: Dict[str, Any],
+        generation: Optional[int] = None
+    ) -> None:
+        """
+        寫入查詢結果，超過容量時淘汰最久未使用的項目
+
+        Args:
+            query_text: 查詢文字
+            threshold: 相似度閾值
+            embedding: 查詢嵌入
+            result: 查詢結果
+            generation: 查詢開始時的 generation；之後有來源失效時不寫入，
+                避免把索引更新期間檢索到的結果留在快取中
+        """
+        key = self._key(query_text, threshold)
+        entry = _CacheEntry(
+            threshold=key[1],
+            embedding=None if embedding is None else np.asarray(embedding, dtype=np.float32),
+            result=dict(result),
+            created_at=time.time(),
+        )
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._index_matrix = None
+
+    def invalidate_sources(self, sources: Iterable[str]) -> int:
+        """
+        使引用指定來源的答案失效
+
+        Args:
+            sources: 重新索引或刪除的來源
+
+        Returns:
+            失效的項目數
+        """
+        sources = set(sources)
+        with self._lock:
+            self.generation += 1
+            stale = [key for key, entry in self._entries.items() if sources & set(entry.result.get("sources", []))]
+            for key in stale:
+                self._remove(key)
+        if stale:
+            logger.info(f"來源更新，使 {len(stale)} 筆快取答案失效")
+        return len(stale)
+
+    def clear(self) -> None:
+        """清空快取"""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._index_matrix = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,71 @@
+import argparse
+import time
+from pathlib import Path
+import yaml
+from .chunking import Chunker, STRATEGIES
+
+DEFAULT_EXTENSIONS = (".txt", ".md")
+
+
+def load_config(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return {}
+
+
+def load_documents(docs_dir: str) -> list:
+    documents = []
+    for file_path in sorted(Path(docs_dir).iterdir()):
+        if file_path.suffix.lower() in DEFAULT_EXTENSIONS:
+            documents.append((file_path.name, file_path.read_text(encoding="utf-8")))
+    return documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較各分割策略的區塊數與匯入時間")
+    parser.add_argument("--config", default="config.yaml", help="設定檔路徑")
+    parser.add_argument("--docs", default="docs", help="文件目錄")
+    parser.add_argument("--chunk-size", type=int, help="區塊大小（預設讀取設定檔）")
+    parser.add_argument("--chunk-overlap", type=int, help="重疊大小（預設讀取設定檔）")
+    parser.add_argument("--embed", action="store_true", help="同時量測嵌入時間")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    chunk_size = args.chunk_size or config.get("chunk_size", 300)
+    chunk_overlap = args.chunk_overlap if args.chunk_overlap is not None else config.get("chunk_overlap", 100)
+    documents = load_documents(args.docs)
+    if not documents:
+        print(f"在 {args.docs} 中沒有找到文件")
+        return
+
+    model = None
+    if args.embed:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(config.get("embedding_model", "shibing624/text2vec-base-chinese"))
+
+    total_chars = sum(len(text) for _, text in documents)
+    print("\n=== 分割基準測試 ===")
+    print(f"文件數: {len(documents)}，總字元數: {total_chars}，區塊大小: {chunk_size}，重疊: {chunk_overlap}")
+    header = f"{'策略':<10}{'區塊數':>8}{'平均長度':>10}{'最大長度':>10}{'分割(ms)':>10}"
+    if model is not None:
+        header += f"{'嵌入(s)':>10}"
+    print(header)
+
+    for strategy in STRATEGIES:
+        chunker = Chunker(strategy=strategy, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        start = time.perf_counter()
+        chunks = [chunk for source, text in documents for chunk in chunker.split(text, source)]
+        split_ms = (time.perf_counter() - start) * 1000
+        lengths = [len(chunk) for chunk in chunks] or [0]
+        row = f"{strategy:<10}{len(chunks):>8}{sum(lengths) / len(lengths):>10.1f}{max(lengths):>10}{split_ms:>10.1f}"
+        if model is not None:
+            start = time.perf_counter()
+            model.encode(chunks, batch_size=config.get("embedding_batch_size", 32), show_progress_bar=False)
+            row += f"{time.perf_counter() - start:>10.2f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import time
+import numpy as np
+from .benchmark_chunking import load_config, load_documents
+from .chunking import Chunker
+from .embedding_backend import BACKENDS, load_embedding_model
+
+DEFAULT_QUERIES = ["專案完成之後要做什麼事"]
+
+
+def encode(model, texts: list, batch_size: int) -> tuple:
+    """回傳 (正規化嵌入, 秒數)"""
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=False)
+    return np.asarray(embeddings, dtype=np.float32), time.perf_counter() - start
+
+
+def query_latency(model, queries: list, repeat: int = 5) -> float:
+    """單筆查詢嵌入的平均延遲（毫秒）"""
+    model.encode(queries[0], normalize_embeddings=True)  # 暖機
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            model.encode(query, normalize_embeddings=True)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(queries))
+
+
+def top_k(chunk_embeddings: np.ndarray, query_embeddings: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(query_embeddings @ chunk_embeddings.T), axis=1)[:, :k]
+
+
+def overlap(reference: np.ndarray, candidate: np.ndarray) -> float:
+    """兩組 top-k 結果的平均重疊比例"""
+    return float(np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(reference, candidate)]))
+
+
+def quantize(embeddings: np.ndarray, dtype: str) -> np.ndarray:
+    """模擬本機向量索引的壓縮儲存後還原"""
+    if dtype == "float16":
+        return embeddings.astype(np.float16).astype(np.float32)
+    scales = np.abs(embeddings).max(axis=1, keepdims=True) / 127.0
+    scales[scales == 0] = 1.0
+    return np.rint(embeddings / scales).astype(np.int8).astype(np.float32) * scales
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較嵌入推論後端與向量儲存型別的準確度與延遲")
+    parser.add_argument("--config", default="config.yaml", help="設定檔路徑")
+    parser.add_argument("--docs", default="docs", help="文件目錄")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS, help="要比較的推論後端")
+    parser.add_argument("--query", action="append", help="測試查詢（可重複指定）")
+    parser.add_argument("--k", type=int, default=5, help="比較 top-k 檢索結果")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    inference_config = config.get("embedding_inference", {})
+    model_name = config.get("embedding_model", "shibing624/text2vec-base-chinese")
+    batch_size = config.get("embedding_batch_size", 32)
+    chunker = Chunker(
+        strategy=config.get("chunking", {}).get("strategy", "recursive"),
+        chunk_size=config.get("chunk_size", 300),
+        chunk_overlap=config.get("chunk_overlap", 100)
+    )
+    chunks = [chunk for source, text in load_documents(args.docs) for chunk in chunker.split(text, source)]
+    if not chunks:
+        print(f"在 {args.docs} 中沒有找到文件")
+        return
+    # 預設以各區塊的第一行作為查詢，涵蓋整個語料
+    queries = args.query or DEFAULT_QUERIES + [chunk.splitlines()[0][:50] for chunk in chunks]
+    k = min(args.k, len(chunks))
+
+    print("\n=== 嵌入基準測試 ===")
+    print(f"模型: {model_name}，區塊數: {len(chunks)}，查詢數: {len(queries)}，top-{k}")
+    print(f"{'後端':<12}{'匯入(s)':>10}{'查詢(ms)':>10}{'平均餘弦':>10}{'最低餘弦':>10}{'top-k 重疊':>12}")
+
+    reference = None
+    for backend in ["torch"] + [b for b in args.backends if b != "torch"]:
+        model, actual = load_embedding_model(
+            model_name,
+            backend=backend,
+            quantization=inference_config.get("quantization", "avx2"),
+            export_path=inference_config.get("path", "data/onnx_models")
+        )
+        if actual != backend:
+            print(f"{backend:<12}載入失敗，略過")
+            continue
+        chunk_embeddings, ingest_seconds = encode(model, chunks, batch_size)
+        query_embeddings, _ = encode(model, queries, batch_size)
+        latency = query_latency(model, queries[:10])
+        if reference is None:
+            reference = (chunk_embeddings, query_embeddings, top_k(chunk_embeddings, query_embeddings, k))
+        cosine = np.sum(chunk_embeddings * reference[0], axis=1)
+        agreement = overlap(reference[2], top_k(chunk_embeddings, query_embeddings, k))
+        print(f"{backend:<12}{ingest_seconds:>10.2f}{latency:>10.1f}{cosine.mean():>10.4f}{cosine.min():>10.4f}{agreement:>12.3f}")
+
+    # 以 PyTorch 嵌入比較本機向量索引的壓縮儲存
+    chunk_embeddings, query_embeddings, reference_top = reference
+    print(f"\n{'儲存型別':<12}{'每向量位元組':>12}{'top-k 重疊':>12}")
+    for dtype in ("float32", "float16", "int8"):
+        stored = chunk_embeddings if dtype == "float32" else quantize(chunk_embeddings, dtype)
+        size = chunk_embeddings.shape[1] * np.dtype(dtype).itemsize + (4 if dtype == "int8" else 0)
+        print(f"{dtype:<12}{size:>12}{overlap(reference_top, top_k(stored, query_embeddings, k)):>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
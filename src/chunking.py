@@ -0,0 +1,139 @@
+from typing import Any, Dict, List, Optional
+import re
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+STRATEGIES = ("recursive", "sentence", "markdown", "auto")
+
+# 中文分隔符，依優先順序排列
+CHINESE_SEPARATORS = ["\n\n", "\n", "。", "！", "？", "；", "，", " ", ""]
+
+_SENTENCE_PATTERN = re.compile(r"[^。！？；!?\n]*(?:[。！？；!?]+[」』）)]*|\n+|$)")
+_HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*\S)\s*$")
+
+
+class Chunker:
+    """
+    依設定的策略分割文件
+
+    - recursive：依中文分隔符遞迴分割（原有行為）
+    - sentence：以中文標點切出句子後組成區塊，重疊部分以完整句子為單位
+    - markdown：依 Markdown 標題切出段落，每個區塊前加上所屬的標題路徑
+    - auto：.md 文件使用 markdown，其餘使用 sentence
+    """
+
+    def __init__(self, strategy: str = "recursive", chunk_size: int = 300, chunk_overlap: int = 100):
+        """
+        初始化分割器
+
+        Args:
+            strategy: 分割策略
+            chunk_size: 區塊大小（字元數）
+            chunk_overlap: 區塊重疊大小（字元數）
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"不支援的分割策略：{strategy}（可用：{', '.join(STRATEGIES)}）")
+        self.strategy = strategy
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self._recursive = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=CHINESE_SEPARATORS,
+            keep_separator=True
+        )
+
+    @property
+    def signature(self) -> Dict[str, Any]:
+        """影響索引內容的分割參數"""
+        return {
+            "chunk_strategy": self.strategy,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+        }
+
+    def split(self, text: str, source: Optional[str] = None) -> List[str]:
+        """
+        分割文件
+
+        Args:
+            text: 文件文字
+            source: 文件來源（auto 策略依副檔名選擇分割方式）
+
+        Returns:
+            文字區塊列表
+        """
+        strategy = self.strategy
+        if strategy == "auto":
+            strategy = "markdown" if source and source.lower().endswith(".md") else "sentence"
+        if strategy == "markdown":
+            return self._split_markdown(text)
+        if strategy == "sentence":
+            return self._split_sentences(text)
+        return self._recursive.split_text(text)
+
+    def _split_sentences(self, text: str, chunk_size: Optional[int] = None) -> List[str]:
+        """以句子為單位組成區塊，過長的句子再遞迴分割"""
+        chunk_size = chunk_size or self.chunk_size
+        sentences = [sentence for sentence in _SENTENCE_PATTERN.findall(text) if sentence]
+        chunks: List[str] = []
+        current: List[str] = []
+        length = 0
+        for sentence in sentences:
+            if len(sentence) > chunk_size:
+                if current:
+                    chunks.append("".join(current).strip())
+                    current, length = [], 0
+                chunks.extend(self._recursive.split_text(sentence))
+                continue
+            if length + len(sentence) > chunk_size and current:
+                chunks.append("".join(current).strip())
+                # 保留結尾的完整句子作為下一個區塊的重疊部分
+                overlap: List[str] = []
+                overlap_length = 0
+                for previous in reversed(current):
+                    if overlap_length + len(previous) > self.chunk_overlap:
+                        break
+                    overlap.insert(0, previous)
+                    overlap_length += len(previous)
+                current, length = overlap, overlap_length
+            current.append(sentence)
+            length += len(sentence)
+        if current:
+            chunks.append("".join(current).strip())
+        return [chunk for chunk in chunks if chunk]
+
+    def _split_markdown(self, text: str) -> List[str]:
+        """依 Markdown 標題分段，每個區塊前加上標題路徑"""
+        sections: List[tuple] = []
+        headings: List[str] = []
+        body: List[str] = []
+        in_code_block = False
+
+        def flush() -> None:
+            content = "\n".join(body).strip()
+            if content:
+                sections.append((" > ".join(headings), content))
+            body.clear()
+
+        for line in text.splitlines():
+            if line.lstrip().startswith("```"):
+                in_code_block = not in_code_block
+            match = None if in_code_block else _HEADING_PATTERN.match(line)
+            if match:
+                flush()
+                level = len(match.group(1))
+                headings[:] = headings[:level - 1] + [match.group(2)]
+                continue
+            body.append(line)
+        flush()
+
+        chunks: List[str] = []
+        for heading_path, content in sections:
+            prefix = f"{heading_path}\n" if heading_path else ""
+            if len(prefix) + len(content) <= self.chunk_size:
+                chunks.append(prefix + content)
+                continue
+            # 扣除標題路徑的長度，讓加上前綴後的區塊仍不超過區塊大小
+            for piece in self._split_sentences(content, max(self.chunk_size - len(prefix), self.chunk_size // 2)):
+                chunks.append(prefix + piece)
+        return chunks
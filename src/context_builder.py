@@ -0,0 +1,163 @@
+from typing import Any, Dict, List, Optional, Tuple
+import re
+from loguru import logger
+
+_CJK_PATTERN = re.compile(r"[㐀-䶿一-鿿豈-﫿　-〿＀-￯]")
+_WORD_PATTERN = re.compile(r"[A-Za-z0-9]+")
+_CHUNK_ID_PATTERN = re.compile(r"chunk_(\d+)$")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗估文字的 token 數：中日韓字元與全形標點各計 1，英數字詞約 4 個字元計 1
+
+    Args:
+        text: 輸入文字
+
+    Returns:
+        估計的 token 數
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    words = sum(max(1, len(word) // 4) for word in _WORD_PATTERN.findall(text))
+    return cjk + words
+
+
+def chunk_position(chunk_id: Any) -> Optional[int]:
+    """從 chunk_{i} 形式的區塊 ID 取出位置"""
+    match = _CHUNK_ID_PATTERN.search(str(chunk_id))
+    return int(match.group(1)) if match else None
+
+
+def merge_overlap(first: str, second: str, min_overlap: int = 1) -> Optional[str]:
+    """
+    若 second 的開頭與 first 的結尾重疊，回傳合併後的文字，否則回傳 None
+
+    Args:
+        first: 前一段文字
+        second: 後一段文字
+        min_overlap: 視為重疊的最短長度
+
+    Returns:
+        合併後的文字或 None
+    """
+    if second in first:
+        return first
+    for size in range(min(len(first), len(second)), min_overlap - 1, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return None
+
+
+class ContextBuilder:
+    """
+    將挑選出的區塊整理成提示詞上下文
+
+    同一來源中位置相鄰或文字重疊的區塊會合併為連續段落並去除重複片段，
+    再依相關性由高到低放入，直到達到 token 預算。
+    """
+
+    def __init__(self, max_tokens: int = 2000, min_overlap: int = 10):
+        """
+        初始化上下文建立器
+
+        Args:
+            max_tokens: 上下文的 token 預算
+            min_overlap: 判斷區塊重疊的最短字元數
+        """
+        self.max_tokens = max_tokens
+        self.min_overlap = min_overlap
+
+    def _merge_source(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """依區塊位置合併同一來源的區塊"""
+        ordered = sorted(
+            chunks,
+            key=lambda chunk: (chunk["position"] is None, chunk["position"] if chunk["position"] is not None else 0)
+        )
+        segments: List[Dict[str, Any]] = []
+        for chunk in ordered:
+            if segments:
+                last = segments[-1]
+                text = chunk["text"]
+                # Markdown 區塊都以所屬的標題路徑開頭，同一標題下的區塊合併前先去除重複的標題路徑
+                head = last["text"].split("\n", 1)[0]
+                if head and text.startswith(head + "\n"):
+                    text = text[len(head) + 1:]
+                merged = merge_overlap(last["text"], text, self.min_overlap)
+                adjacent = (
+                    chunk["position"] is not None
+                    and last["end"] is not None
+                    and chunk["position"] - last["end"] <= 1
+                )
+                if merged is None and adjacent:
+                    merged = f"{last['text']}\n{text}"
+                if merged is not None:
+                    last["text"] = merged
+                    last["score"] = max(last["score"], chunk["score"])
+                    if chunk["position"] is not None:
+                        last["end"] = chunk["position"]
+                    continue
+            segments.append({
+                "text": chunk["text"],
+                "source": chunk["source"],
+                "score": chunk["score"],
+                "end": chunk["position"],
+            })
+        return segments
+
+    def build(self, chunks: List[Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+        """
+        建立上下文段落
+
+        Args:
+            chunks: 區塊列表，每個區塊包含 text、source、chunk_id、score
+
+        Returns:
+            (依相關性排序、總長度不超過 token 預算的段落列表, 實際放入的段落所屬的來源列表)
+        """
+        by_source: Dict[str, List[Dict[str, Any]]] = {}
+        for chunk in chunks:
+            by_source.setdefault(chunk["source"], []).append({**chunk, "position": chunk_position(chunk.get("chunk_id"))})
+
+        segments: List[Dict[str, Any]] = []
+        for source_chunks in by_source.values():
+            segments.extend(self._merge_source(source_chunks))
+        segments.sort(key=lambda segment: segment["score"], reverse=True)
+
+        # 去除內容完全包含在其他段落中的重複片段
+        unique: List[Dict[str, Any]] = []
+        for segment in segments:
+            if not any(segment["text"] in kept["text"] for kept in unique):
+                unique.append(segment)
+
+        # 依相關性放入段落，直到達到 token 預算
+        context: List[str] = []
+        sources: List[str] = []
+        used = 0
+        for segment in unique:
+            tokens = estimate_tokens(segment["text"])
+            if used + tokens > self.max_tokens:
+                if not context:
+                    # 最相關的段落本身超過預算時截斷保留
+                    context.append(self._truncate(segment["text"], self.max_tokens))
+                    sources.append(segment["source"])
+                    used = self.max_tokens
+                continue
+            context.append(segment["text"])
+            if segment["source"] not in sources:
+                sources.append(segment["source"])
+            used += tokens
+
+        logger.info(f"上下文建立完成：{len(chunks)} 個區塊合併為 {len(unique)} 個段落，放入 {len(context)} 個，約 {used} tokens")
+        return context, sources
+
+    @staticmethod
+    def _truncate(text: str, max_tokens: int) -> str:
+        """將文字截斷到約 max_tokens 個 token"""
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if estimate_tokens(text[:mid]) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        return text[:low]
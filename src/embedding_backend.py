@@ -0,0 +1,91 @@
+from typing import Any, Tuple
+import os
+from loguru import logger
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def model_id(model_name: str, backend: str) -> str:
+    """
+    嵌入模型的識別名稱，不同推論後端產生的向量略有差異，需分開快取與索引
+
+    Args:
+        model_name: 嵌入模型名稱
+        backend: 推論後端
+
+    Returns:
+        模型識別名稱（torch 後端沿用模型名稱）
+    """
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+def _export_dir(export_path: str, model_name: str) -> str:
+    return os.path.join(export_path, model_name.replace("/", "__"))
+
+
+def _load_onnx(model_name: str, export_path: str) -> Any:
+    """載入 ONNX 模型，首次使用時匯出並保存"""
+    from sentence_transformers import SentenceTransformer
+
+    save_dir = _export_dir(export_path, model_name)
+    if os.path.exists(os.path.join(save_dir, "onnx", "model.onnx")):
+        return SentenceTransformer(save_dir, backend="onnx")
+    logger.info(f"匯出 ONNX 模型：{model_name} -> {save_dir}")
+    model = SentenceTransformer(model_name, backend="onnx")
+    model.save(save_dir)
+    return model
+
+
+def _load_onnx_int8(model_name: str, export_path: str, quantization: str) -> Any:
+    """載入動態 int8 量化的 ONNX 模型，首次使用時量化並保存"""
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    save_dir = _export_dir(export_path, model_name)
+    # 指定檔名後綴，否則匯出的檔名依量化設定的權重型別而定（例如 avx2 為 model_quint8_avx2.onnx）
+    file_suffix = f"qint8_{quantization}"
+    file_name = f"onnx/model_{file_suffix}.onnx"
+    if not os.path.exists(os.path.join(save_dir, file_name)):
+        model = _load_onnx(model_name, export_path)
+        logger.info(f"量化 ONNX 模型（{quantization}）：{save_dir}/{file_name}")
+        export_dynamic_quantized_onnx_model(model, quantization, save_dir, file_suffix=file_suffix)
+        if not os.path.exists(os.path.join(save_dir, file_name)):
+            raise FileNotFoundError(f"量化後找不到 ONNX 模型檔：{save_dir}/{file_name}")
+    return SentenceTransformer(save_dir, backend="onnx", model_kwargs={"file_name": file_name})
+
+
+def load_embedding_model(
+    model_name: str,
+    backend: str = "torch",
+    quantization: str = "avx2",
+    export_path: str = "data/onnx_models"
+) -> Tuple[Any, str]:
+    """
+    依推論後端載入嵌入模型
+
+    onnx 與 onnx-int8 需要安裝 optimum[onnxruntime]，載入失敗時改用 PyTorch。
+    sentence-transformers 在此才匯入，使用嵌入服務的 worker 不需載入 PyTorch。
+
+    Args:
+        model_name: 嵌入模型名稱
+        backend: 推論後端（torch / onnx / onnx-int8）
+        quantization: int8 量化設定（arm64 / avx2 / avx512 / avx512_vnni）
+        export_path: 匯出的 ONNX 模型目錄
+
+    Returns:
+        (模型, 實際使用的推論後端)
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"不支援的嵌入推論後端：{backend}（可用：{', '.join(BACKENDS)}）")
+    if backend != "torch":
+        try:
+            if backend == "onnx":
+                model = _load_onnx(model_name, export_path)
+            else:
+                model = _load_onnx_int8(model_name, export_path, quantization)
+            logger.info(f"嵌入模型使用 {backend} 推論後端")
+            return model, backend
+        except Exception as e:
+            logger.error(f"載入 {backend} 嵌入模型失敗，改用 PyTorch：{str(e)}")
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model_name), "torch"
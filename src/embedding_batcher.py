@@ -0,0 +1,98 @@
+from typing import Callable, List, Optional
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import numpy as np
+from loguru import logger
+
+
+class EmbeddingBatcher:
+    """
+    查詢嵌入的微批次處理器
+
+    並行的嵌入請求會先進入佇列，背景執行緒在最多等待 max_wait_ms 或累積
+    max_batch_size 筆後一次編碼，再將各列結果交回對應的 Future。
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0
+    ):
+        """
+        初始化微批次處理器
+
+        Args:
+            encode_fn: 將文字列表編碼為嵌入矩陣的函式
+            max_batch_size: 每批最多的請求數
+            max_wait_ms: 收集同批請求的最長等待時間（毫秒）
+        """
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """
+        提交一段文字，回傳完成時帶有嵌入向量的 Future
+
+        Args:
+            text: 輸入文字
+
+        Returns:
+            結果為一維嵌入向量的 Future
+        """
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str) -> np.ndarray:
+        """同步取得單段文字的嵌入"""
+        return self.submit(text).result()
+
+    def _collect(self, first: tuple) -> List[tuple]:
+        """從第一筆請求開始，在等待時間內盡量收集同批請求"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # 保留結束訊號，處理完本批後再結束
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _worker(self) -> None:
+        """背景執行緒：收集請求並批次編碼"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = self._collect(item)
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = self.encode_fn(texts)
+                for (_, future), embedding in zip(batch, embeddings):
+                    future.set_result(embedding)
+                if len(batch) > 1:
+                    logger.debug(f"批次產生查詢嵌入，批次大小：{len(batch)}")
+            except Exception as e:
+                logger.error(f"批次產生查詢嵌入失敗：{str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+
+    def close(self) -> None:
+        """處理完佇列中的請求後停止背景執行緒"""
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,184 @@
+from typing import List, Dict, Tuple
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from loguru import logger
+
+
+class EmbeddingCache:
+    """
+    以區塊內容雜湊值為鍵的持久化嵌入快取
+
+    向量存放在記憶體映射的 float32 陣列中，另以 JSON 檔記錄
+    SHA-256 鍵值到列索引的對應（依 LRU 順序排列）。快取滿時淘汰最久未使用的項目。
+    只有讀取命中時不會寫入索引，使用順序隨下一次新增項目時保存。
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, dim: int, max_entries: int = 100000):
+        """
+        初始化嵌入快取
+
+        Args:
+            cache_dir: 快取目錄
+            model_name: 嵌入模型名稱，不同模型使用各自的快取檔
+            dim: 嵌入向量維度
+            max_entries: 快取最多保留的向量數
+        """
+        self.model_name = model_name
+        self.dim = dim
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._dirty = False
+
+        os.makedirs(cache_dir, exist_ok=True)
+        model_slug = hashlib.sha256(model_name.encode()).hexdigest()[:12]
+        self.vectors_path = os.path.join(cache_dir, f"embeddings_{model_slug}.f32")
+        self.index_path = os.path.join(cache_dir, f"index_{model_slug}.json")
+
+        # 鍵值 -> 列索引，順序即 LRU 順序（最舊在前）
+        self._rows: "OrderedDict[str, int]" = OrderedDict()
+        self._next_row = 0
+        self._vectors = self._open()
+
+    def _open(self) -> np.memmap:
+        """開啟或建立記憶體映射檔，必要時依新容量搬移既有向量"""
+        rows: "OrderedDict[str, int]" = OrderedDict()
+        old_capacity = 0
+        if os.path.exists(self.index_path) and os.path.exists(self.vectors_path):
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                if index.get('model') == self.model_name and index.get('dim') == self.dim:
+                    rows = OrderedDict(index.get('rows', []))
+                    old_capacity = index.get('capacity', 0)
+                else:
+                    logger.info("嵌入快取的模型或維度已變更，重新建立快取")
+            except Exception as e:
+                logger.warning(f"讀取嵌入快取索引失敗，重新建立快取：{str(e)}")
+                rows = OrderedDict()
+            # 索引記錄的容量與向量檔大小不符時（例如容量變更後尚未寫入索引就中斷）無法沿用
+            if rows and os.path.getsize(self.vectors_path) < old_capacity * self.dim * 4:
+                logger.warning("嵌入快取的向量檔與索引不符，重新建立快取")
+                rows = OrderedDict()
+
+        if rows and old_capacity == self.max_entries:
+            vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+',
+                                shape=(self.max_entries, self.dim))
+            self._rows = rows
+            self._next_row = max(rows.values()) + 1
+            logger.info(f"載入嵌入快取：{len(rows)} 筆")
+            return vectors
+
+        # 容量變更時只保留最近使用的項目
+        old_vectors = None
+        if rows:
+            old_vectors = np.array(np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                             shape=(old_capacity, self.dim)))
+            rows = OrderedDict(list(rows.items())[-self.max_entries:])
+
+        vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='w+',
+                            shape=(self.max_entries, self.dim))
+        self._rows = OrderedDict()
+        for new_row, (key, old_row) in enumerate(rows.items()):
+            vectors[new_row] = old_vectors[old_row]
+            self._rows[key] = new_row
+        self._next_row = len(self._rows)
+        # 向量檔已依新容量重建，立即寫入索引，避免磁碟上的索引仍記錄舊容量
+        vectors.flush()
+        self._write_index(list(self._rows.items()))
+        if rows:
+            logger.info(f"嵌入快取容量變更為 {self.max_entries}，保留 {len(rows)} 筆")
+        return vectors
+
+    def _key(self, text: str) -> str:
+        """計算區塊文字的快取鍵值"""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, texts: List[str]) -> Tuple[Dict[int, np.ndarray], List[int]]:
+        """
+        查詢多段文字的快取嵌入
+
+        Args:
+            texts: 文字列表
+
+        Returns:
+            (命中的 {位置: 向量}, 未命中的位置列表)
+        """
+        hits: Dict[int, np.ndarray] = {}
+        misses: List[int] = []
+        with self._lock:
+            for i, text in enumerate(texts):
+                key = self._key(text)
+                row = self._rows.get(key)
+                if row is None:
+                    misses.append(i)
+                    continue
+                # 使用順序只更新在記憶體中，隨下一次寫入新項目時一併保存
+                self._rows.move_to_end(key)
+                hits[i] = np.array(self._vectors[row])
+        return hits, misses
+
+    def put_many(self, texts: List[str], embeddings: np.ndarray) -> None:
+        """
+        寫入多段文字的嵌入，快取已滿時淘汰最久未使用的項目
+
+        Args:
+            texts: 文字列表
+            embeddings: 對應的嵌入矩陣
+        """
+        with self._lock:
+            pending: List[Tuple[int, np.ndarray]] = []
+            new_keys: List[str] = []
+            evicted = False
+            for text, embedding in zip(texts, embeddings):
+                key = self._key(text)
+                row = self._rows.get(key)
+                if row is None:
+                    if self._next_row < self.max_entries:
+                        row = self._next_row
+                        self._next_row += 1
+                    else:
+                        _, row = self._rows.popitem(last=False)
+                        evicted = True
+                    self._rows[key] = row
+                    new_keys.append(key)
+                    pending.append((row, embedding))
+                else:
+                    self._rows.move_to_end(key)
+            if evicted:
+                # 覆寫被淘汰的列之前先把淘汰記錄寫入磁碟上的索引（尚不含本次新增的鍵），
+                # 避免寫入途中中斷時，重新啟動後舊鍵值對應到其他區塊的向量
+                new_key_set = set(new_keys)
+                self._write_index([(key, row) for key, row in self._rows.items() if key not in new_key_set])
+            for row, embedding in pending:
+                self._vectors[row] = embedding
+            if pending:
+                self._dirty = True
+
+    def _write_index(self, rows: List[Tuple[str, int]]) -> None:
+        """以先寫入暫存檔再取代的方式保存索引"""
+        index = {
+            'model': self.model_name,
+            'dim': self.dim,
+            'capacity': self.max_entries,
+            'rows': rows,
+        }
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def flush(self) -> None:
+        """將向量與索引寫回磁碟"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._vectors.flush()
+            self._write_index(list(self._rows.items()))
+            self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self._rows)
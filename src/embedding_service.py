@@ -0,0 +1,239 @@
+from typing import Any, Dict, List, Optional
+import os
+import time
+import argparse
+import threading
+from multiprocessing.connection import Client, Listener
+import numpy as np
+import yaml
+from loguru import logger
+from .embedding_backend import load_embedding_model, model_id
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_cache import EmbeddingCache
+
+
+class EmbeddingServer:
+    """
+    在獨立行程中持有嵌入模型與嵌入快取，透過 Unix socket 提供編碼服務
+
+    多個 uvicorn worker 共用同一份模型，記憶體用量不隨 worker 數增加。
+    單筆文字的請求（查詢）跨 worker 合併為微批次；多筆文字的請求（匯入）
+    先查詢嵌入快取，只編碼未命中的文字。
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        """
+        初始化嵌入服務
+
+        Args:
+            config: 系統設定
+        """
+        service_config = config.get('embedding_service', {})
+        self.socket_path = service_config.get('socket', 'data/embedding.sock')
+        authkey = service_config.get('authkey')
+        self.authkey = authkey.encode() if authkey else None
+        self.batch_size = config.get('embedding_batch_size', 32)
+
+        model_name = config.get('embedding_model', 'shibing624/text2vec-base-chinese')
+        inference_config = config.get('embedding_inference', {})
+        self.model, backend = load_embedding_model(
+            model_name,
+            backend=inference_config.get('backend', 'torch'),
+            quantization=inference_config.get('quantization', 'avx2'),
+            export_path=inference_config.get('path', 'data/onnx_models')
+        )
+        self.model_id = model_id(model_name, backend)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+        cache_config = config.get('embedding_cache', {})
+        self.cache = None
+        if cache_config.get('enabled', True):
+            self.cache = EmbeddingCache(
+                cache_dir=cache_config.get('path', 'data/embedding_cache'),
+                model_name=self.model_id,
+                dim=self.dim,
+                max_entries=cache_config.get('max_entries', 100000)
+            )
+
+        batching_config = config.get('query', {}).get('batching', {})
+        max_batch_size = batching_config.get('max_batch_size', 16)
+        self.batcher = EmbeddingBatcher(
+            encode_fn=lambda texts: self._encode(texts, max_batch_size),
+            max_batch_size=max_batch_size,
+            max_wait_ms=batching_config.get('max_wait_ms', 5)
+        )
+        self._stopped = threading.Event()
+
+    def _encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        return np.asarray(self.model.encode(
+            texts,
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        ), dtype=np.float32)
+
+    def encode(self, texts: List[str], cached: bool = True) -> np.ndarray:
+        """
+        編碼文字
+
+        Args:
+            texts: 文字列表
+            cached: 是否使用嵌入快取（查詢不使用）
+
+        Returns:
+            正規化的嵌入矩陣
+        """
+        if len(texts) == 1 and not cached:
+            return self.batcher.embed(texts[0])[None, :]
+        if self.cache is None or not cached:
+            return self._encode(texts, self.batch_size)
+
+        hits, misses = self.cache.get_many(texts)
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, vector in hits.items():
+            embeddings[i] = vector
+        if misses:
+            miss_texts = [texts[i] for i in misses]
+            encoded = self._encode(miss_texts, self.batch_size)
+            embeddings[misses] = encoded
+            self.cache.put_many(miss_texts, encoded)
+            self.cache.flush()
+        return embeddings
+
+    def _handle(self, conn: Any) -> None:
+        """處理單一 worker 連線上的請求"""
+        try:
+            while not self._stopped.is_set():
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    break
+                try:
+                    if request['op'] == 'info':
+                        conn.send({'ok': True, 'model_id': self.model_id, 'dim': self.dim})
+                    elif request['op'] == 'encode':
+                        embeddings = self.encode(request['texts'], request.get('cached', True))
+                        conn.send({'ok': True, 'embeddings': embeddings})
+                    else:
+                        conn.send({'ok': False, 'error': f"不支援的操作：{request['op']}"})
+                except Exception as e:
+                    logger.error(f"嵌入服務處理請求失敗：{str(e)}")
+                    conn.send({'ok': False, 'error': str(e)})
+        finally:
+            conn.close()
+
+    def serve_forever(self) -> None:
+        """開始接受 worker 連線，每個連線使用一個執行緒"""
+        os.makedirs(os.path.dirname(self.socket_path) or '.', exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        listener = Listener(self.socket_path, family='AF_UNIX', authkey=self.authkey)
+        os.chmod(self.socket_path, 0o600)
+        logger.info(f"嵌入服務已啟動：{self.socket_path}（模型：{self.model_id}）")
+        try:
+            while not self._stopped.is_set():
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.warning(f"接受嵌入服務連線失敗：{str(e)}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), name="embed-conn", daemon=True).start()
+        finally:
+            listener.close()
+            self.batcher.close()
+
+
+class RemoteEmbeddingModel:
+    """
+    嵌入服務的客戶端，提供與 SentenceTransformer 相同的 encode 介面
+
+    每個執行緒使用各自的連線，連線中斷時自動重新連線一次。
+    """
+
+    def __init__(self, socket_path: str, authkey: Optional[str] = None, connect_timeout: float = 120):
+        """
+        初始化嵌入服務客戶端
+
+        Args:
+            socket_path: 嵌入服務的 Unix socket 路徑
+            authkey: 連線驗證金鑰
+            connect_timeout: 等待嵌入服務啟動（載入模型）的秒數
+        """
+        self.socket_path = socket_path
+        self.authkey = authkey.encode() if authkey else None
+        self._local = threading.local()
+        deadline = time.monotonic() + connect_timeout
+        while True:
+            try:
+                info = self._request({'op': 'info'})
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+        self.model_id = info['model_id']
+        self.dim = info['dim']
+        logger.info(f"連線到嵌入服務：{socket_path}（模型：{self.model_id}）")
+
+    def _connection(self) -> Any:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = Client(self.socket_path, family='AF_UNIX', authkey=self.authkey)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send(request)
+                response = conn.recv()
+                break
+            except (EOFError, OSError):
+                self._local.conn = None
+                if attempt:
+                    raise
+        if not response['ok']:
+            raise RuntimeError(f"嵌入服務錯誤：{response['error']}")
+        return response
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, sentences: Any, **kwargs) -> np.ndarray:
+        """
+        編碼文字；向量一律正規化，其餘 SentenceTransformer 參數由服務端設定決定
+
+        單段文字視為查詢，由服務端跨 worker 微批次處理；文字列表視為文件區塊，
+        使用服務端的嵌入快取。
+
+        Args:
+            sentences: 單段文字或文字列表
+
+        Returns:
+            嵌入向量（單段文字）或嵌入矩陣
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+        embeddings = self._request({'op': 'encode', 'texts': texts, 'cached': not single})['embeddings']
+        return embeddings[0] if single else embeddings
+
+
+def run(config: Dict[str, Any]) -> None:
+    """啟動嵌入服務（可作為子行程的進入點）"""
+    EmbeddingServer(config).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="啟動共用的嵌入服務")
+    parser.add_argument("--config", default="config.yaml", help="設定檔路徑")
+    args = parser.parse_args()
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    run(config)
+
+
+if __name__ == "__main__":
+    main()
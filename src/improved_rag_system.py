@@ -1,14 +1,30 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterator, AsyncIterator
 import os
 import yaml
 import hashlib
+import threading
+import asyncio
+import contextvars
+from contextlib import contextmanager, ExitStack
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import chromadb
 import google.generativeai as genai
-from sentence_transformers import SentenceTransformer
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from loguru import logger
+from .embedding_cache import EmbeddingCache
+from .embedding_batcher import EmbeddingBatcher
+from .answer_cache import AnswerCache
+from .vector_store import LocalVectorStore, AsyncLocalVectorStore
+from .lexical_index import LexicalIndex
+from .warmup import file_lock
+from .reranker import Reranker
+from .context_builder import ContextBuilder
+from .chunking import Chunker
+from .embedding_backend import load_embedding_model, model_id
+from .embedding_service import RemoteEmbeddingModel
+from .metrics import STAGE_SECONDS, CACHE_LOOKUPS, CHUNKS_INGESTED, GEMINI_ERRORS, timed
+from .tracing import span, traced
 
 class ImprovedRAGSystem:
     def __init__(self, config_path: str = "config.yaml"):
@@ -58,25 +74,110 @@ class ImprovedRAGSystem:
             self.model = genai.GenerativeModel('gemini-1.5-flash')  # 使用 1.5 版本
             
             # 初始化 Sentence Transformer
-            self.embedding_model = SentenceTransformer(
-                'shibing624/text2vec-base-chinese'  # 使用專門的中文模型
+            self.embedding_model_name = self.config.get('embedding_model', 'shibing624/text2vec-base-chinese')  # 預設使用專門的中文模型
+            service_config = self.config.get('embedding_service', {})
+            self.use_embedding_service = service_config.get('enabled', False)
+            if self.use_embedding_service:
+                # 多 worker 部署時由嵌入服務持有模型與嵌入快取
+                self.embedding_model = RemoteEmbeddingModel(
+                    socket_path=service_config.get('socket', 'data/embedding.sock'),
+                    authkey=service_config.get('authkey'),
+                    connect_timeout=service_config.get('connect_timeout', 120)
+                )
+                self.embedding_backend = 'service'
+                self.embedding_model_id = self.embedding_model.model_id
+            else:
+                inference_config = self.config.get('embedding_inference', {})
+                self.embedding_model, self.embedding_backend = load_embedding_model(
+                    self.embedding_model_name,
+                    backend=inference_config.get('backend', 'torch'),
+                    quantization=inference_config.get('quantization', 'avx2'),
+                    export_path=inference_config.get('path', 'data/onnx_models')
+                )
+                # 快取與索引以包含推論後端的識別名稱區分
+                self.embedding_model_id = model_id(self.embedding_model_name, self.embedding_backend)
+            
+            # 初始化嵌入快取
+            self.embedding_cache = self._create_embedding_cache()
+            
+            # 各來源的寫入鎖，避免同一文件被並行更新
+            self._source_locks: Dict[str, threading.Lock] = {}
+            self._source_locks_guard = threading.Lock()
+            
+            # 非同步查詢使用的資源：嵌入專用執行緒池、生成並行上限與延遲建立的非同步集合
+            query_config = self.config.get('query', {})
+            self._embedding_executor = ThreadPoolExecutor(
+                max_workers=query_config.get('embedding_workers', 2),
+                thread_name_prefix="embed"
             )
+            self._generation_semaphore = asyncio.Semaphore(query_config.get('max_concurrent_generations', 8))
+            self._async_lock = asyncio.Lock()
+            self._async_collection = None
             
-            # 初始化 ChromaDB
-            self.client = chromadb.HttpClient(
-                host=self.config.get('chroma_host', 'localhost'),
-                port=self.config.get('chroma_port', 8000)
+            # 查詢嵌入微批次處理器
+            self.embedding_batcher = self._create_embedding_batcher()
+            
+            # 答案快取
+            self.answer_cache = self._create_answer_cache()
+            
+            # 初始化向量儲存
+            store_config = self.config.get('vector_store', {})
+            self.vector_backend = store_config.get('backend', 'chroma')
+            if self.vector_backend == 'local':
+                # 行程內向量索引，不需連線 ChromaDB
+                self.client = None
+                self.collection = LocalVectorStore(
+                    path=store_config.get('path', 'data/vector_index'),
+                    name=self.config.get('collection_name', 'documents'),
+                    index=store_config.get('index', 'flat'),
+                    hnsw_min_size=store_config.get('hnsw_min_size', 5000),
+                    storage_dtype=store_config.get('storage_dtype', 'float32')
+                )
+            else:
+                # 初始化 ChromaDB
+                self.client = chromadb.HttpClient(
+                    host=self.config.get('chroma_host', 'localhost'),
+                    port=self.config.get('chroma_port', 8000)
+                )
+                
+                # 取得或建立集合
+                self.collection = self._get_or_create_collection()
+            
+            # 初始化文件分割器
+            chunking_config = self.config.get('chunking', {})
+            self.chunker = Chunker(
+                strategy=chunking_config.get('strategy', 'recursive'),
+                chunk_size=self.config.get('chunk_size', 300),
+                chunk_overlap=self.config.get('chunk_overlap', 100)
             )
             
-            # 取得或建立集合
-            self.collection = self._get_or_create_collection()
+            # 分割或嵌入參數變更時重建集合，由啟動同步重新匯入；與啟動同步共用匯入鎖並等待其釋放，
+            # 避免清掉其他 worker 正在匯入的內容，也確保取得的是重建後的集合
+            ingest_lock = self.config.get('startup', {}).get('ingest_lock', 'data/ingest.lock')
+            with file_lock(ingest_lock, blocking=True):
+                self._check_index_params(reindex=chunking_config.get('reindex_on_change', True))
+            
+            # 混合檢索用的 BM25 詞彙索引，以一次批次查詢從向量集合建立
+            if self.config.get('retrieval', {}).get('hybrid', False):
+                self.lexical_index = LexicalIndex.from_collection(self.collection)
+            else:
+                self.lexical_index = None
+            
+            # 選用的 cross-encoder 重排序器
+            rerank_config = self.config.get('rerank', {})
+            if rerank_config.get('enabled', False):
+                self.reranker = Reranker(
+                    model_name=rerank_config.get('model', 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1'),
+                    time_budget_ms=rerank_config.get('time_budget_ms', 300)
+                )
+            else:
+                self.reranker = None
             
-            # 初始化文字分割器
-            self.text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=300,      # 較小的區塊大小
-                chunk_overlap=100,   # 適當的重疊
-                separators=["\n\n", "\n", "。", "！", "？", "；", "，", " ", ""],  # 中文分隔符
-                keep_separator=True  # 保留分隔符
+            # 上下文建立器
+            context_config = self.config.get('context', {})
+            self.context_builder = ContextBuilder(
+                max_tokens=context_config.get('max_tokens', 2000),
+                min_overlap=context_config.get('min_overlap', 10)
             )
             
             logger.info("所有元件初始化成功")
@@ -105,6 +206,87 @@ class ImprovedRAGSystem:
             logger.error(f"取得或建立集合失敗：{str(e)}")
             raise
     
+    def _check_index_params(self, reindex: bool = True) -> None:
+        """
+        比對集合記錄的分割與嵌入參數，參數變更時重建集合以便重新匯入
+
+        Args:
+            reindex: 參數變更時是否清空集合；為 False 時只記錄警告
+        """
+        params = {**self.chunker.signature, "embedding_model": self.embedding_model_id}
+        if self.client is not None:
+            # 重新取得集合，讀到其他 worker 在取得鎖前寫入的參數
+            self.collection = self._get_or_create_collection()
+        stored = self.collection.metadata or {}
+        stored_params = {key: stored.get(key) for key in params}
+        if stored_params == params:
+            return
+        
+        count = self.collection.count()
+        if count and not reindex:
+            logger.warning(f"索引參數與設定不符，沿用既有索引：{stored_params} -> {params}")
+            return
+        if count:
+            logger.warning(f"索引參數變更，清空 {count} 個區塊並重新匯入：{stored_params} -> {params}")
+        # 刪除全部區塊後集合仍保留原本的向量維度，嵌入模型的維度改變時無法再新增，因此整個重建
+        metadata = {**stored, **params}
+        if self.client is not None:
+            name = self.config.get('collection_name', 'documents')
+            self.client.delete_collection(name)
+            self.collection = self.client.create_collection(name=name, metadata=metadata)
+        else:
+            self.collection.reset(metadata=metadata)
+        logger.info(f"記錄索引參數：{params}")
+    
+    def _create_embedding_cache(self) -> Optional[EmbeddingCache]:
+        """依設定建立區塊嵌入快取，未啟用或使用嵌入服務（由服務端快取）時回傳 None"""
+        cache_config = self.config.get('embedding_cache', {})
+        if not cache_config.get('enabled', True) or self.use_embedding_service:
+            return None
+        if self.config.get('server', {}).get('workers', 1) > 1:
+            # 快取檔無法由多個行程同時寫入，各 worker 會覆寫彼此的列與索引
+            logger.warning("多 worker 部署未啟用嵌入服務，停用嵌入快取；請啟用 embedding_service 以共用快取")
+            return None
+        try:
+            return EmbeddingCache(
+                cache_dir=cache_config.get('path', 'data/embedding_cache'),
+                model_name=self.embedding_model_id,
+                dim=self.embedding_model.get_sentence_embedding_dimension(),
+                max_entries=cache_config.get('max_entries', 100000)
+            )
+        except Exception as e:
+            logger.warning(f"嵌入快取初始化失敗，停用快取：{str(e)}")
+            return None
+    
+    def _create_embedding_batcher(self) -> Optional[EmbeddingBatcher]:
+        """依設定建立查詢嵌入微批次處理器，未啟用或使用嵌入服務（由服務端合併批次）時回傳 None"""
+        batching_config = self.config.get('query', {}).get('batching', {})
+        if not batching_config.get('enabled', True) or self.use_embedding_service:
+            return None
+        max_batch_size = batching_config.get('max_batch_size', 16)
+        return EmbeddingBatcher(
+            encode_fn=lambda texts: self.embedding_model.encode(
+                texts,
+                batch_size=max_batch_size,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            ),
+            max_batch_size=max_batch_size,
+            max_wait_ms=batching_config.get('max_wait_ms', 5)
+        )
+    
+    def _create_answer_cache(self) -> Optional[AnswerCache]:
+        """依設定建立答案快取，未啟用時回傳 None"""
+        cache_config = self.config.get('answer_cache', {})
+        if not cache_config.get('enabled', True):
+            return None
+        return AnswerCache(
+            max_entries=cache_config.get('max_entries', 512),
+            ttl_seconds=cache_config.get('ttl_seconds', 3600),
+            similarity_cutoff=cache_config.get('similarity_cutoff', 0.95)
+        )
+    
     def get_document_hash(self, text: str, metadata: dict) -> str:
         """
         計算文件的雜湊值
@@ -131,80 +313,764 @@ class ImprovedRAGSystem:
         """
         try:
             logger.info(f"正在產生文字嵌入，文字長度：{len(text)}")
-            embedding = self.embedding_model.encode(text, normalize_embeddings=True)
-            return embedding.tolist()
+            with STAGE_SECONDS.time(stage="embed"), span("embedding"):
+                if self.embedding_batcher is not None:
+                    return self.embedding_batcher.embed(text).tolist()
+                embedding = self.embedding_model.encode(text, normalize_embeddings=True)
+                return embedding.tolist()
         except Exception as e:
             logger.error(f"產生文字嵌入失敗：{str(e)}")
             raise
     
-    def add_document(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+    def embed_texts(self, texts: List[str], progress_callback: Optional[Callable[[int, int], None]] = None) -> np.ndarray:
         """
-        新增文件到向量儲存
+        批次產生多段文字的嵌入
         
         Args:
-            text: 文件文字
-            metadata: 文件元資料
-        """
-        if metadata is None:
-            metadata = {}
+            texts: 輸入文字列表
+            progress_callback: 進度回呼，參數為（已完成區塊數，總區塊數）
             
+        Returns:
+            形狀為 (len(texts), dim) 的 float32 嵌入矩陣
+        """
+        if not texts:
+            return np.empty((0, self.embedding_model.get_sentence_embedding_dimension()), dtype=np.float32)
         try:
-            # 計算文件雜湊值
-            doc_hash = self.get_document_hash(text, metadata)
-            metadata['doc_hash'] = doc_hash
+            embeddings = None
+            misses = list(range(len(texts)))
+            if self.embedding_cache is not None:
+                hits, misses = self.embedding_cache.get_many(texts)
+                if hits:
+                    embeddings = np.empty((len(texts), self.embedding_cache.dim), dtype=np.float32)
+                    for i, vector in hits.items():
+                        embeddings[i] = vector
+                logger.info(f"嵌入快取命中 {len(hits)} 個區塊，需重新編碼 {len(misses)} 個區塊")
+                CACHE_LOOKUPS.inc(len(hits), cache="embedding", result="hit")
+                CACHE_LOOKUPS.inc(len(misses), cache="embedding", result="miss")
+            
+            done = len(texts) - len(misses)
+            if progress_callback is not None:
+                progress_callback(done, len(texts))
             
-            # 檢查文件是否已存在且內容相同
+            if misses:
+                miss_texts = [texts[i] for i in misses]
+                encoded = self._encode_batch(
+                    miss_texts,
+                    None if progress_callback is None
+                    else lambda n, _: progress_callback(done + n, len(texts))
+                )
+                if embeddings is None:
+                    embeddings = encoded
+                else:
+                    embeddings[misses] = encoded
+                if self.embedding_cache is not None:
+                    self.embedding_cache.put_many(miss_texts, encoded)
+            
+            if self.embedding_cache is not None:
+                self.embedding_cache.flush()
+            return embeddings
+        except Exception as e:
+            logger.error(f"批次產生文字嵌入失敗：{str(e)}")
+            raise
+    
+    def _encode_batch(self, texts: List[str], progress_callback: Optional[Callable[[int, int], None]] = None) -> np.ndarray:
+        """
+        以設定的批次大小呼叫嵌入模型
+        
+        Args:
+            texts: 輸入文字列表
+            progress_callback: 進度回呼，每完成一批呼叫一次
+            
+        Returns:
+            float32 嵌入矩陣
+        """
+        batch_size = self.config.get('embedding_batch_size', 32)
+        logger.info(f"正在批次產生文字嵌入，文字數：{len(texts)}，批次大小：{batch_size}")
+        if progress_callback is None:
+            step = len(texts)
+        else:
+            step = batch_size
+        
+        parts = []
+        for start in range(0, len(texts), step):
+            parts.append(self.embedding_model.encode(
+                texts[start:start + step],
+                batch_size=batch_size,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            ))
+            if progress_callback is not None:
+                progress_callback(min(start + step, len(texts)), len(texts))
+        return np.asarray(np.concatenate(parts), dtype=np.float32)
+    
+    def get_chunk_ids(self, chunks: List[str], namespace: str) -> List[str]:
+        """
+        依區塊內容產生穩定的區塊 ID
+        
+        相同內容的區塊在文件更新前後會得到相同 ID；同一文件中重複的區塊以出現次序區分。
+        
+        Args:
+            chunks: 文字區塊列表
+            namespace: ID 前綴（通常為來源名稱）
+            
+        Returns:
+            區塊 ID 列表
+        """
+        prefix = hashlib.sha256(namespace.encode()).hexdigest()[:16]
+        occurrences: Dict[str, int] = {}
+        ids = []
+        for chunk in chunks:
+            chunk_hash = hashlib.sha256(chunk.encode()).hexdigest()[:32]
+            n = occurrences.get(chunk_hash, 0)
+            occurrences[chunk_hash] = n + 1
+            ids.append(f"{prefix}_{chunk_hash}_{n}")
+        return ids
+    
+    def _plan_document(self, text: str, metadata: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        計算文件與現有索引之間的區塊差異
+        
+        Args:
+            text: 文件文字
+            metadata: 文件元資料（會寫入 doc_hash）
+            
+        Returns:
+            包含新增、保留與刪除區塊的更新計畫；文件未變更或為空時回傳 None
+        """
+        # 計算文件雜湊值
+        doc_hash = self.get_document_hash(text, metadata)
+        metadata['doc_hash'] = doc_hash
+        
+        # 取得同一來源的既有區塊；所有區塊都已是此雜湊值時文件未變更。
+        # 上次更新中途失敗時只有部分區塊帶有新雜湊值，需要重新處理
+        existing_ids = set()
+        if 'source' in metadata:
+            try:
+                old_docs = self.collection.get(
+                    where={"source": metadata['source']},
+                    include=["metadatas"]
+                )
+                old_metadatas = (old_docs or {}).get('metadatas') or []
+                if old_metadatas and all(m and m.get('doc_hash') == doc_hash for m in old_metadatas):
+                    logger.info(f"文件已存在且未更改（雜湊值：{doc_hash}），跳過處理")
+                    return None
+                existing_ids = set(old_docs['ids']) if old_docs else set()
+            except Exception as e:
+                logger.warning(f"取得舊版本區塊時發生錯誤：{str(e)}")
+        else:
             try:
                 existing_docs = self.collection.get(
-                    where={"doc_hash": doc_hash}
+                    where={"doc_hash": doc_hash},
+                    limit=1,
+                    include=["metadatas"]
                 )
                 if existing_docs and existing_docs['metadatas']:
                     logger.info(f"文件已存在且未更改（雜湊值：{doc_hash}），跳過處理")
-                    return
+                    return None
             except Exception as e:
                 logger.warning(f"檢查文件存在時發生錯誤：{str(e)}")
-            
-            # 如果是更新，先刪除舊版本
-            if 'source' in metadata:
-                try:
-                    old_docs = self.collection.get(
-                        where={"source": metadata['source']}
-                    )
-                    if old_docs and old_docs['metadatas']:
-                        old_hash = old_docs['metadatas'][0].get('doc_hash', '')
-                        if old_hash == doc_hash:
-                            logger.info(f"文件內容未變更（來源：{metadata['source']}），跳過處理")
-                            return
-                        self.collection.delete(
-                            where={"source": metadata['source']}
-                        )
-                        logger.info(f"刪除舊版本文件：{metadata['source']}")
-                except Exception as e:
-                    logger.warning(f"刪除舊版本時發生錯誤：{str(e)}")
-            
-            # 處理新文件
-            chunks = self.text_splitter.split_text(text)
-            if not chunks:
-                logger.warning("文件分割後為空，跳過處理")
-                return
-                
-            # 產生嵌入
-            embeddings = [self.embed_text(chunk) for chunk in chunks]
+        
+        chunks = self.chunker.split(text, metadata.get('source'))
+        chunk_ids = self.get_chunk_ids(chunks, metadata.get('source', doc_hash))
+        chunk_metadatas = [{**metadata, "chunk_id": f"chunk_{i}"} for i in range(len(chunks))]
+        
+        new_ids = set(chunk_ids)
+        plan = {
+            "delete_ids": sorted(existing_ids - new_ids),
+            "keep_ids": [],
+            "keep_metadatas": [],
+            "add_ids": [],
+            "add_chunks": [],
+            "add_metadatas": [],
+        }
+        for chunk_id, chunk, chunk_metadata in zip(chunk_ids, chunks, chunk_metadatas):
+            if chunk_id in existing_ids:
+                plan["keep_ids"].append(chunk_id)
+                plan["keep_metadatas"].append(chunk_metadata)
+            else:
+                plan["add_ids"].append(chunk_id)
+                plan["add_chunks"].append(chunk)
+                plan["add_metadatas"].append(chunk_metadata)
+        
+        if not chunks:
+            logger.warning("文件分割後為空")
+        logger.info(
+            f"文件差異（來源：{metadata.get('source', '未知')}）："
+            f"新增 {len(plan['add_ids'])}，保留 {len(plan['keep_ids'])}，刪除 {len(plan['delete_ids'])} 個區塊"
+        )
+        return plan
+    
+    def add_document(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+        """
+        新增文件到向量儲存
+        
+        Args:
+            text: 文件文字
+            metadata: 文件元資料
+        """
+        self.add_documents([(text, metadata)])
+    
+    @timed("ingest_total")
+    @traced("rag.ingest")
+    def add_documents(
+        self,
+        documents: List[Tuple[str, Optional[Dict[str, Any]]]],
+        progress_callback: Optional[Callable[[int, int], None]] = None
+    ) -> None:
+        """
+        批次新增多份文件到向量儲存，所有區塊合併後分批產生嵌入並一次寫入
+        
+        Args:
+            documents: (文件文字, 文件元資料) 的列表
+            progress_callback: 嵌入進度回呼，參數為（已嵌入區塊數，總區塊數）
+        """
+        documents = [(text, metadata if metadata is not None else {}) for text, metadata in documents]
+        sources = [metadata['source'] for _, metadata in documents if 'source' in metadata]
+        try:
+            with self._lock_sources(sources), self._batch_writes():
+                self._add_documents(documents, progress_callback)
+        except Exception as e:
+            logger.error(f"新增文件失敗：{str(e)}")
+            raise
+    
+    @contextmanager
+    def _lock_sources(self, sources: List[str]) -> Iterator[None]:
+        """依固定順序取得各來源的鎖，避免同一文件被並行更新"""
+        with self._source_locks_guard:
+            locks = [self._source_locks.setdefault(source, threading.Lock()) for source in sorted(set(sources))]
+        with ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            yield
+    
+    @contextmanager
+    def _batch_writes(self) -> Iterator[None]:
+        """本機向量索引在區塊內的新增、更新與刪除只於結束時寫入磁碟一次；ChromaDB 由伺服器端保存"""
+        if isinstance(self.collection, LocalVectorStore):
+            with self.collection.batch():
+                yield
+        else:
+            yield
+    
+    def _add_documents(
+        self,
+        documents: List[Tuple[str, Dict[str, Any]]],
+        progress_callback: Optional[Callable[[int, int], None]]
+    ) -> None:
+        """add_documents 的實作，呼叫端需已持有相關來源的鎖"""
+        plans = []
+        all_chunks: List[str] = []
+        all_metadatas: List[Dict[str, Any]] = []
+        all_ids: List[str] = []
+        
+        for text, metadata in documents:
+            plan = self._plan_document(text, metadata)
+            if plan is None:
+                continue
+            plans.append((plan, metadata))
+            all_chunks.extend(plan["add_chunks"])
+            all_metadatas.extend(plan["add_metadatas"])
+            all_ids.extend(plan["add_ids"])
+        
+        if not plans:
+            return
+        
+        # 先為新區塊產生嵌入並寫入；失敗時索引維持舊版本，重試時會重新計算差異
+        if all_chunks:
+            with STAGE_SECONDS.time(stage="ingest_embed"), span("embedding"):
+                embeddings = self.embed_texts(all_chunks, progress_callback)
             
             # 新增到 ChromaDB
-            self.collection.add(
-                embeddings=embeddings,
-                documents=chunks,
-                metadatas=[{**metadata, "chunk_id": f"chunk_{i}"} for i in range(len(chunks))],
-                ids=[f"doc_{doc_hash}_chunk_{i}" for i in range(len(chunks))]
-            )
+            with span("chromadb.add", chunks=len(all_chunks)):
+                self.collection.add(
+                    embeddings=embeddings,
+                    documents=all_chunks,
+                    metadatas=all_metadatas,
+                    ids=all_ids
+                )
+            if self.lexical_index is not None:
+                self.lexical_index.add(all_ids, all_chunks, all_metadatas)
+            CHUNKS_INGESTED.inc(len(all_chunks))
+        
+        for plan, metadata in plans:
+            # 新區塊寫入後才更新保留區塊的元資料（位置與文件雜湊值），並刪除已消失的區塊
+            if plan["keep_ids"]:
+                self.collection.update(ids=plan["keep_ids"], metadatas=plan["keep_metadatas"])
+            if plan["delete_ids"]:
+                self.collection.delete(ids=plan["delete_ids"])
+            if self.lexical_index is not None:
+                self.lexical_index.remove(plan["delete_ids"])
+                self.lexical_index.update_metadatas(plan["keep_ids"], plan["keep_metadatas"])
             
-            logger.info(f"成功新增/更新文件（雜湊值：{doc_hash}，區塊數：{len(chunks)}）")
+            # 索引更新完成後才使答案快取失效，避免更新期間的查詢把半更新的結果寫回快取
+            if self.answer_cache is not None and 'source' in metadata:
+                self.answer_cache.invalidate_sources([metadata['source']])
+        
+        logger.info(f"成功新增/更新文件（文件數：{len(documents)}，新增區塊數：{len(all_chunks)}）")
+    
+    def get_indexed_documents(self) -> Dict[str, set]:
+        """
+        以一次批次查詢取得索引中所有來源及其文件雜湊值
+        
+        Returns:
+            {來源: 文件雜湊值集合} 字典
+        """
+        results = self.collection.get(include=["metadatas"])
+        indexed: Dict[str, set] = {}
+        for metadata in (results or {}).get("metadatas") or []:
+            if metadata and "source" in metadata:
+                indexed.setdefault(metadata["source"], set()).add(metadata.get("doc_hash", ""))
+        return indexed
+    
+    def sync_directory(self, docs_dir: str, allowed_extensions: List[str]) -> List[str]:
+        """
+        掃描文件目錄，只將新增或內容變更的文件送入批次嵌入流程
+        
+        Args:
+            docs_dir: 文件目錄
+            allowed_extensions: 允許的副檔名
             
-        except Exception as e:
-            logger.error(f"新增文件失敗：{str(e)}")
-            raise
+        Returns:
+            本次重新索引的檔名列表
+        """
+        indexed = self.get_indexed_documents()
+        filenames = [
+            filename for filename in os.listdir(docs_dir)
+            if any(filename.endswith(ext) for ext in allowed_extensions)
+        ]
+        
+        def load(filename: str) -> Optional[Tuple[str, str, str]]:
+            try:
+                with open(os.path.join(docs_dir, filename), 'r', encoding='utf-8') as f:
+                    text = f.read()
+                return filename, text, self.get_document_hash(text, {"source": filename})
+            except Exception as e:
+                logger.error(f"載入文件 {filename} 時發生錯誤：{str(e)}")
+                return None
+        
+        # 在執行緒池中讀取檔案並計算雜湊值
+        max_workers = self.config.get('ingestion', {}).get('hash_workers', 8)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            loaded = [item for item in pool.map(load, filenames) if item is not None]
+        
+        changed = [
+            (filename, text) for filename, text, doc_hash in loaded
+            if indexed.get(filename) != {doc_hash}
+        ]
+        logger.info(f"文件目錄掃描完成：共 {len(loaded)} 個文件，{len(changed)} 個需要重新索引")
+        
+        if changed:
+            self.add_documents([(text, {"source": filename}) for filename, text in changed])
+        return [filename for filename, _ in changed]
+
+    @traced("rag.delete")
+    def delete_document(self, source: str) -> int:
+        """
+        以一次批次操作從向量儲存移除指定來源的所有區塊，並同步更新詞彙索引與答案快取
+
+        Args:
+            source: 文件來源（檔名）
+
+        Returns:
+            移除的區塊數
+        """
+        with self._lock_sources([source]), self._batch_writes():
+            ids = self.collection.get(where={"source": source}, include=[])["ids"]
+            if ids:
+                self.collection.delete(ids=ids)
+            if self.lexical_index is not None:
+                self.lexical_index.remove_source(source)
+            if self.answer_cache is not None:
+                self.answer_cache.invalidate_sources([source])
+        logger.info(f"已從索引移除文件 {source}（區塊數：{len(ids)}）")
+        return len(ids)
+
+    def purge_orphans(self, docs_dir: str) -> List[str]:
+        """
+        移除來源檔案已不在文件目錄中的區塊
+
+        Args:
+            docs_dir: 文件目錄
+
+        Returns:
+            被移除的來源列表
+        """
+        existing = set(os.listdir(docs_dir))
+        orphans = sorted(source for source in self.get_indexed_documents() if source not in existing)
+        with self._batch_writes():
+            for source in orphans:
+                self.delete_document(source)
+        if orphans:
+            logger.info(f"已清除 {len(orphans)} 個孤立文件的區塊：{', '.join(orphans)}")
+        return orphans
+
+    def refresh_lexical_index(self) -> int:
+        """
+        從向量集合重建 BM25 詞彙索引並整體替換，納入其他 worker 匯入或刪除的文件
+
+        Returns:
+            重建後的區塊數；未啟用混合檢索時為 0
+        """
+        if self.lexical_index is None:
+            return 0
+        lexical_index = LexicalIndex.from_collection(self.collection)
+        self.lexical_index = lexical_index
+        logger.info(f"已重建詞彙索引（區塊數：{len(lexical_index)}）")
+        return len(lexical_index)
+
+    def _resolve_threshold(self, similarity_threshold: Optional[float]) -> float:
+        """取得本次查詢使用的相似度閾值"""
+        default_threshold = self.config["server"]["similarity_settings"]["default_threshold"]
+        threshold = similarity_threshold if similarity_threshold is not None else default_threshold
+        logger.info(f"使用相似度閾值：{threshold}")
+        return threshold
+    
+    def _select_chunks(
+        self,
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+        similarities: np.ndarray,
+        threshold: float,
+        dense_similarities: Optional[np.ndarray] = None,
+        absolute: bool = False
+    ) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        對檢索結果計算正規化相似度，並依閾值與來源挑選文字區塊
+        
+        Args:
+            documents: 候選文字區塊
+            metadatas: 候選區塊的元資料
+            similarities: 候選區塊的相似度（或融合分數），決定排序
+            threshold: 相似度閾值
+            dense_similarities: 混合檢索時各候選的向量餘弦相似度（只由詞彙檢索找到的為 NaN）；
+                閾值改套用在正規化的餘弦相似度上，因為融合分數只反映排名。只由詞彙檢索找到的
+                候選不套用閾值，改以 retrieval.fused_top_k 限制融合後的數量
+            absolute: similarities 是否為可跨查詢比較的絕對分數（重排序的相關機率）；
+                為 True 時不做正規化，閾值直接套用在分數上
+            
+        Returns:
+            (挑選出的區塊（含 text、source、chunk_id、score）, 來源列表)
+        """
+        query_config = self.config.get('query', {})
+        max_per_source = query_config.get('max_chunks_per_source', 3)
+        
+        # 正規化到 [0,1] 範圍
+        similarities = np.asarray(similarities, dtype=np.float32)
+        max_similarity = similarities.max()
+        min_similarity = similarities.min()
+        similarity_range = max_similarity - min_similarity
+        if absolute:
+            normalized = similarities
+        elif similarity_range > 0:
+            normalized = (similarities - min_similarity) / similarity_range
+        else:
+            normalized = (similarities == max_similarity).astype(np.float32)
+        
+        if query_config.get('trace_hits', False):
+            for i, (doc, metadata) in enumerate(zip(documents, metadatas)):
+                logger.info(
+                    f"文字 {i+1} - 原始相似度：{similarities[i]:.4f}，正規化相似度：{normalized[i]:.4f}，"
+                    f"來源：{metadata.get('source', '未知')}，區塊 ID：{metadata.get('chunk_id', '未知')}"
+                )
+                logger.info(f"內容片段：{doc[:100]}...")
+        
+        # 依正規化相似度排序並套用閾值
+        order = np.argsort(-normalized, kind='stable')
+        if dense_similarities is None:
+            passed = order[normalized[order] >= threshold]
+        else:
+            gate = self._normalize_dense(dense_similarities)
+            passed = order[np.isnan(gate[order]) | (gate[order] >= threshold)]
+            passed = passed[:self.config.get('retrieval', {}).get('fused_top_k', 10)]
+        if len(passed) == 0:
+            return [], []
+        
+        # 依來源分組（依各來源最相關區塊出現的順序），每個來源最多保留前幾個區塊
+        sources = np.array([metadatas[i].get("source", "未知") for i in passed], dtype=object)
+        unique_sources, first_index, inverse = np.unique(sources, return_index=True, return_inverse=True)
+        group_rank = np.argsort(np.argsort(first_index))[inverse]
+        grouped = np.argsort(group_rank, kind='stable')
+        group_sizes = np.bincount(group_rank)
+        group_starts = np.concatenate(([0], np.cumsum(group_sizes)[:-1]))
+        rank_in_group = np.arange(len(grouped)) - np.repeat(group_starts, group_sizes)
+        selected = passed[grouped[rank_in_group < max_per_source]]
+        
+        filtered_chunks = [
+            {
+                "text": documents[i],
+                "source": metadatas[i].get("source", "未知"),
+                "chunk_id": metadatas[i].get("chunk_id"),
+                "score": float(normalized[i]),
+            }
+            for i in selected
+        ]
+        filtered_sources = unique_sources[np.argsort(first_index)].tolist()
+        return filtered_chunks, filtered_sources
+    
+    @staticmethod
+    def _normalize_dense(dense_similarities: np.ndarray) -> np.ndarray:
+        """以與純向量檢索相同的方式將餘弦相似度正規化到 [0,1]，NaN 保持不變"""
+        dense_similarities = np.asarray(dense_similarities, dtype=np.float32)
+        known = dense_similarities[~np.isnan(dense_similarities)]
+        if len(known) == 0:
+            return dense_similarities
+        similarity_range = known.max() - known.min()
+        if similarity_range > 0:
+            return (dense_similarities - known.min()) / similarity_range
+        return np.where(np.isnan(dense_similarities), np.nan, (dense_similarities == known.max()).astype(np.float32))
+    
+    def _build_prompt(self, query_text: str, chunks: List[str]) -> str:
+        """
+        建立送往 Gemini 的提示詞
+        
+        Args:
+            query_text: 查詢文字
+            chunks: 上下文文字區塊
+            
+        Returns:
+            提示詞
+        """
+        # 建立上下文
+        context = "\n\n---\n\n".join(chunks)
+        
+        # 使用 Gemini 產生答案
+        prompt = f"""基於以下文字內容回答問題。如果文字內容不足以回答問題，請說明無法回答。
+
+問題：{query_text}
+
+文字內容：
+{context}
+
+請根據上述文字內容提供準確、簡潔的回答。如果內容相關性不夠，請明確指出。
+如果找到相關內容，請盡可能完整地回答問題。"""
+        
+        logger.debug(f"發送到 Gemini 的提示詞：\n{prompt}")
+        return prompt
+    
+    def _fuse_lexical(
+        self,
+        query_text: str,
+        results: dict
+    ) -> Tuple[List[str], List[Dict[str, Any]], np.ndarray, np.ndarray]:
+        """
+        以倒數排名融合（RRF）合併向量檢索與 BM25 詞彙檢索的結果
+        
+        Args:
+            query_text: 查詢文字
+            results: ChromaDB 查詢結果
+            
+        Returns:
+            (候選文字區塊, 元資料, 融合分數, 向量餘弦相似度（只由詞彙檢索找到的為 NaN）)
+        """
+        retrieval_config = self.config.get('retrieval', {})
+        rrf_k = retrieval_config.get('rrf_k', 60)
+        lexical_hits = self.lexical_index.search(query_text, retrieval_config.get('lexical_k', 20))
+        
+        candidates: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        scores: Dict[str, float] = {}
+        dense: Dict[str, float] = {}
+        for rank, (chunk_id, doc, metadata, distance) in enumerate(
+            zip(results["ids"][0], results["documents"][0], results["metadatas"][0], results["distances"][0])
+        ):
+            candidates[chunk_id] = (doc, metadata)
+            scores[chunk_id] = 1.0 / (rrf_k + rank + 1)
+            dense[chunk_id] = 1.0 - distance
+        # 只由詞彙檢索找到的區塊向集合取回目前內容，其他 worker 已刪除或更新的區塊
+        # 不會以詞彙索引中的舊文字進入提示詞
+        lexical_only = [chunk_id for chunk_id, _ in lexical_hits if chunk_id not in candidates]
+        current: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        if lexical_only:
+            fetched = self.collection.get(ids=lexical_only, include=["documents", "metadatas"])
+            current = {
+                chunk_id: (doc, metadata)
+                for chunk_id, doc, metadata in zip(fetched["ids"], fetched["documents"], fetched["metadatas"])
+            }
+            missing = [chunk_id for chunk_id in lexical_only if chunk_id not in current]
+            if missing:
+                logger.info(f"詞彙索引中有 {len(missing)} 個區塊已不在集合中，從詞彙索引移除")
+                self.lexical_index.remove(missing)
+        for rank, (chunk_id, _) in enumerate(lexical_hits):
+            if chunk_id not in candidates:
+                if chunk_id not in current:
+                    continue
+                candidates[chunk_id] = current[chunk_id]
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+        
+        ids = list(candidates)
+        logger.info(f"混合檢索：向量 {len(results['ids'][0])} 筆，詞彙 {len(lexical_hits)} 筆，合併後 {len(ids)} 筆")
+        return (
+            [candidates[chunk_id][0] for chunk_id in ids],
+            [candidates[chunk_id][1] for chunk_id in ids],
+            np.array([scores[chunk_id] for chunk_id in ids], dtype=np.float32),
+            np.array([dense.get(chunk_id, np.nan) for chunk_id in ids], dtype=np.float32)
+        )
+    
+    def _gather_candidates(
+        self,
+        query_text: str,
+        results: dict
+    ) -> Tuple[List[str], List[Dict[str, Any]], np.ndarray, Optional[np.ndarray]]:
+        """
+        整理檢索候選：啟用混合檢索時融合詞彙檢索結果
+        
+        Returns:
+            (候選文字區塊, 元資料, 相似度或融合分數, 混合檢索時的向量餘弦相似度或 None)
+        """
+        if self.lexical_index is not None:
+            return self._fuse_lexical(query_text, results)
+        return (
+            results["documents"][0],
+            results["metadatas"][0],
+            1.0 - np.asarray(results["distances"][0], dtype=np.float32),
+            None
+        )
+    
+    def _rerank_inputs(
+        self,
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+        similarities: np.ndarray,
+        dense_similarities: Optional[np.ndarray]
+    ) -> Tuple[List[str], List[Dict[str, Any]], np.ndarray, Optional[np.ndarray]]:
+        """取出分數最高、要送入重排序的候選"""
+        max_candidates = self.config.get('rerank', {}).get('max_candidates', 20)
+        similarities = np.asarray(similarities, dtype=np.float32)
+        top = np.argsort(-similarities, kind='stable')[:max_candidates]
+        return (
+            [documents[i] for i in top],
+            [metadatas[i] for i in top],
+            similarities[top],
+            None if dense_similarities is None else dense_similarities[top]
+        )
+    
+    def _apply_rerank(
+        self,
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+        scores: np.ndarray
+    ) -> Tuple[List[str], List[Dict[str, Any]], np.ndarray]:
+        """依重排序分數只保留前 top_n 個候選"""
+        top_n = self.config.get('rerank', {}).get('top_n', 6)
+        top = np.argsort(-scores, kind='stable')[:top_n]
+        logger.info(f"重排序完成，從 {len(documents)} 個候選保留 {len(top)} 個")
+        return [documents[i] for i in top], [metadatas[i] for i in top], scores[top]
+    
+    def _prepare_context(self, query_text: str, results: dict, threshold: float) -> Tuple[Optional[dict], List[str], List[str]]:
+        """
+        從檢索結果挑選上下文，沒有可用內容時回傳對應的回覆
+        
+        Returns:
+            (提前回傳的結果或 None, 文字區塊, 來源列表)
+        """
+        documents, metadatas, similarities, dense = self._gather_candidates(query_text, results)
+        if self.reranker is not None and documents:
+            documents, metadatas, similarities, dense = self._rerank_inputs(documents, metadatas, similarities, dense)
+            scores = self.reranker.rerank(query_text, documents)
+            if scores is not None:
+                # 重排序分數為 sigmoid(logit) 的絕對相關機率，不做正規化，改以 rerank.threshold 過濾
+                documents, metadatas, similarities = self._apply_rerank(documents, metadatas, scores)
+                rerank_threshold = self.config.get('rerank', {}).get('threshold', 0.5)
+                return self._context_from_candidates(
+                    documents, metadatas, similarities, rerank_threshold, absolute=True
+                )
+        return self._context_from_candidates(documents, metadatas, similarities, threshold, dense)
+    
+    async def _aprepare_context(self, query_text: str, results: dict, threshold: float) -> Tuple[Optional[dict], List[str], List[str]]:
+        """_prepare_context 的非同步版本，詞彙檢索與重排序不阻塞事件迴圈"""
+        if self.lexical_index is not None:
+            # 混合檢索會向集合取回詞彙命中的區塊，在執行緒中執行
+            documents, metadatas, similarities, dense = await asyncio.to_thread(
+                self._gather_candidates, query_text, results
+            )
+        else:
+            documents, metadatas, similarities, dense = self._gather_candidates(query_text, results)
+        if self.reranker is not None and documents:
+            documents, metadatas, similarities, dense = self._rerank_inputs(documents, metadatas, similarities, dense)
+            scores = await self.reranker.arerank(query_text, documents)
+            if scores is not None:
+                # 重排序分數為 sigmoid(logit) 的絕對相關機率，不做正規化，改以 rerank.threshold 過濾
+                documents, metadatas, similarities = self._apply_rerank(documents, metadatas, scores)
+                rerank_threshold = self.config.get('rerank', {}).get('threshold', 0.5)
+                return self._context_from_candidates(
+                    documents, metadatas, similarities, rerank_threshold, absolute=True
+                )
+        return self._context_from_candidates(documents, metadatas, similarities, threshold, dense)
+    
+    def _context_from_candidates(
+        self,
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+        similarities: np.ndarray,
+        threshold: float,
+        dense_similarities: Optional[np.ndarray] = None,
+        absolute: bool = False
+    ) -> Tuple[Optional[dict], List[str], List[str]]:
+        """
+        依閾值與來源挑選上下文，沒有可用內容時回傳對應的回覆
+        
+        Returns:
+            (提前回傳的結果或 None, 文字區塊, 來源列表)
+        """
+        if not documents:
+            logger.warning("沒有找到任何相關文字")
+            return {"answer": "抱歉，我在文件中找不到相關的資訊。", "sources": [], "enhanced_prompt": ""}, [], []
+        
+        filtered_chunks, filtered_sources = self._select_chunks(
+            documents, metadatas, similarities, threshold, dense_similarities, absolute
+        )
+        
+        if not filtered_chunks:
+            logger.warning(f"沒有文字通過相似度閾值 {threshold} 的過濾")
+            return {
+                "answer": f"抱歉，沒有找到相似度高於 {threshold:.2f} 的相關文字。請嘗試調低相似度閾值。",
+                "sources": [],
+                "enhanced_prompt": ""
+            }, [], []
+        
+        logger.info(f"過濾後保留了 {len(filtered_chunks)} 個相關片段，來自 {len(filtered_sources)} 個文件")
+        
+        # 合併重疊區塊並依 token 預算組成上下文，來源只列出實際放入上下文的文件
+        context, context_sources = self.context_builder.build(filtered_chunks)
+        return None, context, context_sources
+    
+    def _lookup_answer_cache(self, query_text: str, threshold: float, query_embedding: Optional[List[float]] = None) -> Optional[dict]:
+        """
+        查詢答案快取：未提供嵌入時只比對完全相同的問題，否則比對相近問題
+        
+        Returns:
+            快取的查詢結果，未命中或未啟用時回傳 None
+        """
+        if self.answer_cache is None:
+            return None
+        if query_embedding is None:
+            result = self.answer_cache.get(query_text, threshold)
+            if result is not None:
+                logger.info("相同問題命中答案快取")
+            CACHE_LOOKUPS.inc(cache="answer_exact", result="miss" if result is None else "hit")
+            return result
+        result = self.answer_cache.get_similar(query_embedding, threshold)
+        CACHE_LOOKUPS.inc(cache="answer_similar", result="miss" if result is None else "hit")
+        return result
+    
+    def _answer_generation(self) -> Optional[int]:
+        """查詢開始時的答案快取 generation，寫入答案時用來判斷期間是否有來源更新"""
+        return self.answer_cache.generation if self.answer_cache is not None else None
+    
+    def _store_answer(
+        self,
+        query_text: str,
+        threshold: float,
+        query_embedding: List[float],
+        result: dict,
+        generation: Optional[int] = None
+    ) -> None:
+        """將成功產生的答案寫入快取"""
+        if self.answer_cache is not None:
+            self.answer_cache.put(query_text, threshold, query_embedding, result, generation)
     
+    @timed("query_total")
+    @traced("rag.query")
     def query(self, query_text: str, similarity_threshold: Optional[float] = None) -> dict:
         """
         查詢文字並回傳答案
@@ -217,125 +1083,219 @@ class ImprovedRAGSystem:
             包含答案和來源的字典
         """
         try:
-            # 取得預設閾值
-            default_threshold = self.config["server"]["similarity_settings"]["default_threshold"]
-            threshold = similarity_threshold if similarity_threshold is not None else default_threshold
-            logger.info(f"使用相似度閾值：{threshold}")
+            threshold = self._resolve_threshold(similarity_threshold)
+            generation = self._answer_generation()
+            cached = self._lookup_answer_cache(query_text, threshold)
+            if cached is not None:
+                return cached
             
             # 取得查詢的嵌入向量
             query_embedding = self.embed_text(query_text)
+            cached = self._lookup_answer_cache(query_text, threshold, query_embedding)
+            if cached is not None:
+                return cached
             
             # 在 ChromaDB 中搜尋相似文字，增加檢索數量
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=20,  # 增加檢索數量
-                include=["documents", "metadatas", "distances"]
-            )
+            with STAGE_SECONDS.time(stage="vector_search"), span("chromadb.query"):
+                results = self.collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=self.config.get('query', {}).get('n_results', 20),
+                    include=["documents", "metadatas", "distances"]
+                )
             
-            if not results["documents"][0]:
-                logger.warning("沒有找到任何相關文字")
-                return {"answer": "抱歉，我在文件中找不到相關的資訊。", "sources": [], "enhanced_prompt": ""}
+            with STAGE_SECONDS.time(stage="filter"), span("rag.filter"):
+                early_result, filtered_chunks, filtered_sources = self._prepare_context(query_text, results, threshold)
+            if early_result is not None:
+                return early_result
             
-            # 計算並輸出所有檢索結果的相似度
-            all_results = []
-            max_similarity = float('-inf')
-            min_similarity = float('inf')
+            prompt = self._build_prompt(query_text, filtered_chunks)
             
-            # 先找出最大和最小相似度
-            for distance in results["distances"][0]:
-                similarity = 1 - distance
-                max_similarity = max(max_similarity, similarity)
-                min_similarity = min(min_similarity, similarity)
+            try:
+                with STAGE_SECONDS.time(stage="generate"), span("gemini.generate"):
+                    response = self.model.generate_content(prompt)
+                    answer = response.text
+                logger.debug(f"Gemini 回傳的答案：{answer}")
+            except Exception as e:
+                logger.error(f"Gemini API 呼叫失敗：{str(e)}")
+                GEMINI_ERRORS.inc(operation="query")
+                return {"answer": "抱歉，產生答案時出現錯誤。", "sources": filtered_sources, "enhanced_prompt": prompt}
             
-            # 計算相似度範圍
-            similarity_range = max_similarity - min_similarity
+            result = {
+                "answer": answer,
+                "sources": filtered_sources,
+                "enhanced_prompt": prompt
+            }
+            self._store_answer(query_text, threshold, query_embedding, result, generation)
+            return result
             
-            # 對相似度進行正規化處理
-            for i, (doc, distance) in enumerate(zip(results["documents"][0], results["distances"][0])):
-                # 原始相似度
-                raw_similarity = 1 - distance
-                
-                # 正規化相似度到 [0,1] 範圍
-                if similarity_range > 0:
-                    normalized_similarity = (raw_similarity - min_similarity) / similarity_range
-                else:
-                    normalized_similarity = 1 if raw_similarity == max_similarity else 0
-                
-                source = results["metadatas"][0][i].get("source", "未知")
-                chunk_id = results["metadatas"][0][i].get("chunk_id", "未知")
-                
-                # 記錄詳細資訊
-                all_results.append({
-                    "chunk": doc,
-                    "raw_similarity": raw_similarity,
-                    "normalized_similarity": normalized_similarity,
-                    "source": source,
-                    "chunk_id": chunk_id
-                })
-                logger.info(f"文字 {i+1} - 原始相似度：{raw_similarity:.4f}，正規化相似度：{normalized_similarity:.4f}，來源：{source}，區塊 ID：{chunk_id}")
-                logger.info(f"內容片段：{doc[:100]}...")
+        except Exception as e:
+            logger.error(f"查詢處理失敗：{str(e)}")
+            return {"answer": "抱歉，處理查詢時出現錯誤。", "sources": [], "enhanced_prompt": ""}
+    
+    async def _get_async_collection(self) -> Any:
+        """取得非同步 ChromaDB 集合，首次呼叫時建立連線"""
+        if self._async_collection is None and self.vector_backend == 'local':
+            self._async_collection = AsyncLocalVectorStore(self.collection)
+        if self._async_collection is None:
+            async with self._async_lock:
+                if self._async_collection is None:
+                    client = await chromadb.AsyncHttpClient(
+                        host=self.config.get('chroma_host', 'localhost'),
+                        port=self.config.get('chroma_port', 8000)
+                    )
+                    self._async_collection = await client.get_collection(
+                        self.config.get('collection_name', 'documents')
+                    )
+        return self._async_collection
+    
+    @timed("query_total")
+    @traced("rag.query")
+    async def aquery(self, query_text: str, similarity_threshold: Optional[float] = None) -> dict:
+        """
+        非同步查詢文字並回傳答案
+        
+        嵌入在專用的執行緒池中計算，檢索使用非同步 ChromaDB 用戶端，
+        生成使用 Gemini 的非同步 API，並以信號量限制同時進行的生成數。
+        
+        Args:
+            query_text: 查詢文字
+            similarity_threshold: 相似度閾值，如果為 None 則使用預設值
             
-            # 根據正規化相似度排序
-            all_results.sort(key=lambda x: x["normalized_similarity"], reverse=True)
-            
-            # 使用正規化後的相似度進行過濾
-            filtered_chunks = []
-            filtered_sources = set()
-            current_source_chunks = {}
-            
-            for result in all_results:
-                if result["normalized_similarity"] >= threshold:
-                    source = result["source"]
-                    if source not in current_source_chunks:
-                        current_source_chunks[source] = []
-                    current_source_chunks[source].append(result["chunk"])
-                    filtered_sources.add(source)
-            
-            # 對每個來源的文字區塊進行排序和合併
-            for source, chunks in current_source_chunks.items():
-                filtered_chunks.extend(chunks[:3])  # 每個來源最多使用前 3 個最相關的區塊
-            
-            if not filtered_chunks:
-                logger.warning(f"沒有文字通過相似度閾值 {threshold} 的過濾")
-                return {
-                    "answer": f"抱歉，沒有找到相似度高於 {threshold:.2f} 的相關文字。請嘗試調低相似度閾值。",
-                    "sources": [],
-                    "enhanced_prompt": ""
-                }
-            
-            logger.info(f"過濾後保留了 {len(filtered_chunks)} 個相關片段，來自 {len(filtered_sources)} 個文件")
-            
-            # 建立上下文
-            context = "\n\n---\n\n".join(filtered_chunks)
-            
-            # 使用 Gemini 產生答案
-            prompt = f"""基於以下文字內容回答問題。如果文字內容不足以回答問題，請說明無法回答。
-
-問題：{query_text}
-
-文字內容：
-{context}
-
-請根據上述文字內容提供準確、簡潔的回答。如果內容相關性不夠，請明確指出。
-如果找到相關內容，請盡可能完整地回答問題。"""
+        Returns:
+            包含答案和來源的字典
+        """
+        try:
+            threshold = self._resolve_threshold(similarity_threshold)
+            generation = self._answer_generation()
+            cached = self._lookup_answer_cache(query_text, threshold)
+            if cached is not None:
+                return cached
+            
+            query_embedding = await self._aembed_query(query_text)
+            cached = self._lookup_answer_cache(query_text, threshold, query_embedding)
+            if cached is not None:
+                return cached
+            
+            early_result, filtered_chunks, filtered_sources = await self._aretrieve_context(query_text, query_embedding, threshold)
+            if early_result is not None:
+                return early_result
             
-            logger.info("發送到 Gemini 的提示詞：")
-            logger.info(prompt)
+            prompt = self._build_prompt(query_text, filtered_chunks)
             
             try:
-                response = self.model.generate_content(prompt)
+                async with self._generation_semaphore:
+                    with STAGE_SECONDS.time(stage="generate"), span("gemini.generate"):
+                        response = await self.model.generate_content_async(prompt)
                 answer = response.text
-                logger.info(f"Gemini 回傳的答案：{answer}")
+                logger.debug(f"Gemini 回傳的答案：{answer}")
             except Exception as e:
                 logger.error(f"Gemini API 呼叫失敗：{str(e)}")
-                answer = "抱歉，產生答案時出現錯誤。"
+                GEMINI_ERRORS.inc(operation="query")
+                return {"answer": "抱歉，產生答案時出現錯誤。", "sources": filtered_sources, "enhanced_prompt": prompt}
             
-            return {
+            result = {
                 "answer": answer,
-                "sources": list(filtered_sources),
+                "sources": filtered_sources,
                 "enhanced_prompt": prompt
             }
+            self._store_answer(query_text, threshold, query_embedding, result, generation)
+            return result
             
         except Exception as e:
             logger.error(f"查詢處理失敗：{str(e)}")
-            return {"answer": "抱歉，處理查詢時出現錯誤。", "sources": [], "enhanced_prompt": ""} 
\ No newline at end of file
+            return {"answer": "抱歉，處理查詢時出現錯誤。", "sources": [], "enhanced_prompt": ""}
+    
+    async def _aembed_query(self, query_text: str) -> List[float]:
+        """非同步產生查詢嵌入：啟用微批次時直接等待批次結果，否則在專用執行緒池中計算"""
+        if self.embedding_batcher is not None:
+            logger.info(f"正在產生文字嵌入，文字長度：{len(query_text)}")
+            with STAGE_SECONDS.time(stage="embed"), span("embedding"):
+                return (await asyncio.wrap_future(self.embedding_batcher.submit(query_text))).tolist()
+        loop = asyncio.get_running_loop()
+        # 複製 context 讓執行緒池中的 span 掛在目前的追蹤之下
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._embedding_executor, context.run, self.embed_text, query_text)
+    
+    async def _aretrieve_context(self, query_text: str, query_embedding: List[float], threshold: float) -> Tuple[Optional[dict], List[str], List[str]]:
+        """
+        非同步檢索並挑選上下文
+        
+        Returns:
+            (提前回傳的結果或 None, 文字區塊, 來源列表)
+        """
+        # 在 ChromaDB 中搜尋相似文字
+        collection = await self._get_async_collection()
+        with STAGE_SECONDS.time(stage="vector_search"), span("chromadb.query"):
+            results = await collection.query(
+                query_embeddings=[query_embedding],
+                n_results=self.config.get('query', {}).get('n_results', 20),
+                include=["documents", "metadatas", "distances"]
+            )
+        
+        with STAGE_SECONDS.time(stage="filter"), span("rag.filter"):
+            return await self._aprepare_context(query_text, results, threshold)
+    
+    @timed("query_total")
+    @traced("rag.query")
+    async def astream_query(self, query_text: str, similarity_threshold: Optional[float] = None) -> AsyncIterator[dict]:
+        """
+        以串流方式查詢：先回傳來源，再逐段回傳 Gemini 產生的答案
+        
+        Args:
+            query_text: 查詢文字
+            similarity_threshold: 相似度閾值，如果為 None 則使用預設值
+            
+        Yields:
+            事件字典，event 為 sources / token / done / error
+        """
+        try:
+            threshold = self._resolve_threshold(similarity_threshold)
+            generation = self._answer_generation()
+            cached = self._lookup_answer_cache(query_text, threshold)
+            query_embedding = None
+            if cached is None:
+                query_embedding = await self._aembed_query(query_text)
+                cached = self._lookup_answer_cache(query_text, threshold, query_embedding)
+            if cached is not None:
+                yield {"event": "sources", "data": {"sources": cached["sources"], "enhanced_prompt": cached["enhanced_prompt"]}}
+                yield {"event": "token", "data": {"text": cached["answer"]}}
+                yield {"event": "done", "data": {}}
+                return
+            early_result, filtered_chunks, filtered_sources = await self._aretrieve_context(query_text, query_embedding, threshold)
+        except Exception as e:
+            logger.error(f"查詢處理失敗：{str(e)}")
+            yield {"event": "error", "data": {"message": "抱歉，處理查詢時出現錯誤。"}}
+            return
+        
+        if early_result is not None:
+            yield {"event": "sources", "data": {"sources": [], "enhanced_prompt": ""}}
+            yield {"event": "token", "data": {"text": early_result["answer"]}}
+            yield {"event": "done", "data": {}}
+            return
+        
+        prompt = self._build_prompt(query_text, filtered_chunks)
+        yield {"event": "sources", "data": {"sources": filtered_sources, "enhanced_prompt": prompt}}
+        
+        answer_parts = []
+        try:
+            async with self._generation_semaphore:
+                with STAGE_SECONDS.time(stage="generate"), span("gemini.generate", current=False):
+                    response = await self.model.generate_content_async(prompt, stream=True)
+                    async for chunk in response:
+                        if chunk.text:
+                            answer_parts.append(chunk.text)
+                            yield {"event": "token", "data": {"text": chunk.text}}
+            answer = ''.join(answer_parts)
+            logger.debug(f"Gemini 回傳的答案：{answer}")
+        except Exception as e:
+            logger.error(f"Gemini API 呼叫失敗：{str(e)}")
+            GEMINI_ERRORS.inc(operation="query")
+            yield {"event": "error", "data": {"message": "抱歉，產生答案時出現錯誤。"}}
+            return
+        
+        self._store_answer(query_text, threshold, query_embedding, {
+            "answer": answer,
+            "sources": filtered_sources,
+            "enhanced_prompt": prompt
+        }, generation)
+        yield {"event": "done", "data": {}}
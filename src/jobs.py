@@ -0,0 +1,121 @@
+from typing import Any, Callable, Dict, Optional
+import time
+import uuid
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from loguru import logger
+
+
+@dataclass
+class Job:
+    """背景工作的狀態與進度"""
+
+    id: str
+    kind: str
+    status: str = "pending"  # pending / running / done / failed
+    progress: int = 0
+    total: int = 0
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def set_progress(self, progress: int, total: int) -> None:
+        """更新進度（可作為 progress_callback 傳入）"""
+        self.progress = progress
+        self.total = total
+
+    def to_dict(self) -> Dict[str, Any]:
+        """轉換為 API 回應格式"""
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "total": self.total,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """以固定大小的執行緒池執行背景工作，並保留最近的工作狀態供查詢"""
+
+    def __init__(self, max_workers: int = 2, max_history: int = 1000, name: str = "job"):
+        """
+        初始化工作管理器
+
+        Args:
+            max_workers: 同時執行的工作數
+            max_history: 最多保留的工作狀態數
+            name: 執行緒名稱前綴
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_history = max_history
+
+    def submit(self, kind: str, fn: Callable[..., Any], *args, **kwargs) -> Job:
+        """
+        提交背景工作
+
+        fn 會以關鍵字參數 progress_callback 接收進度回呼。
+
+        Args:
+            kind: 工作類型
+            fn: 要執行的函式
+
+        Returns:
+            新建立的工作
+        """
+        job = Job(id=uuid.uuid4().hex, kind=kind)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        # 複製提交時的 context，讓背景工作的追蹤 span 掛在發起請求的追蹤之下
+        context = contextvars.copy_context()
+        self._executor.submit(context.run, self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job: Job, fn: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+        """在工作執行緒中執行工作並記錄結果"""
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = fn(*args, progress_callback=job.set_progress, **kwargs)
+            job.status = "done"
+        except Exception as e:
+            logger.error(f"背景工作失敗（{job.kind}，{job.id}）：{str(e)}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _trim(self) -> None:
+        """移除超出保留數量的已完成工作"""
+        excess = len(self._jobs) - self.max_history
+        if excess <= 0:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished_at is not None][:excess]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """取得工作狀態"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def queue_depth(self) -> int:
+        """尚未完成的工作數"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status in ("pending", "running"))
+
+    def shutdown(self) -> None:
+        """停止接受新工作並等待執行中的工作結束"""
+        self._executor.shutdown(wait=True)
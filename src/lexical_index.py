@@ -0,0 +1,137 @@
+from typing import Any, Dict, Iterable, List, Tuple
+import re
+import math
+import threading
+import unicodedata
+from collections import Counter
+from loguru import logger
+
+# 中日韓文字連續段落與英數字詞（含 1,000、113/05/01、3.5 等數字格式）
+_TOKEN_PATTERN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+|[a-z0-9]+(?:[.,/:-][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中文友善的斷詞：中文以單字與雙字 n-gram 表示，英數字保留完整詞
+
+    Args:
+        text: 輸入文字
+
+    Returns:
+        詞彙列表
+    """
+    tokens: List[str] = []
+    for match in _TOKEN_PATTERN.finditer(unicodedata.normalize("NFKC", text).lower()):
+        segment = match.group()
+        if segment[0].isascii():
+            tokens.append(segment)
+            continue
+        tokens.extend(segment)
+        tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+    return tokens
+
+
+class LexicalIndex:
+    """以倒排索引實作的 BM25 詞彙檢索，與向量索引使用相同的區塊 ID"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        初始化詞彙索引
+
+        Args:
+            k1: BM25 詞頻飽和參數
+            b: BM25 文件長度正規化參數
+        """
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._metadatas: Dict[str, Dict[str, Any]] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def add(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """新增或取代區塊"""
+        with self._lock:
+            self.remove(ids)
+            for chunk_id, document, metadata in zip(ids, documents, metadatas):
+                terms = Counter(tokenize(document))
+                for term, tf in terms.items():
+                    self._postings.setdefault(term, {})[chunk_id] = tf
+                self._doc_terms[chunk_id] = terms
+                length = sum(terms.values())
+                self._doc_lengths[chunk_id] = length
+                self._total_length += length
+                self._metadatas[chunk_id] = dict(metadata or {})
+
+    def update_metadatas(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """更新既有區塊的元資料"""
+        with self._lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                if chunk_id in self._metadatas:
+                    self._metadatas[chunk_id].update(metadata)
+
+    def remove(self, ids: Iterable[str]) -> None:
+        """移除區塊"""
+        with self._lock:
+            for chunk_id in ids:
+                terms = self._doc_terms.pop(chunk_id, None)
+                if terms is None:
+                    continue
+                for term in terms:
+                    postings = self._postings.get(term)
+                    if postings is not None:
+                        postings.pop(chunk_id, None)
+                        if not postings:
+                            del self._postings[term]
+                self._total_length -= self._doc_lengths.pop(chunk_id)
+                del self._metadatas[chunk_id]
+
+    def remove_source(self, source: str) -> int:
+        """移除指定來源的所有區塊，回傳移除的區塊數"""
+        with self._lock:
+            ids = [chunk_id for chunk_id, metadata in self._metadatas.items() if metadata.get("source") == source]
+            self.remove(ids)
+            return len(ids)
+
+    def search(self, query_text: str, k: int = 20) -> List[Tuple[str, float]]:
+        """
+        以 BM25 分數檢索區塊
+
+        Args:
+            query_text: 查詢文字
+            k: 回傳的區塊數
+
+        Returns:
+            依分數由高到低排序的 (區塊 ID, 分數) 列表
+        """
+        with self._lock:
+            n_docs = len(self._doc_lengths)
+            if n_docs == 0:
+                return []
+            avg_length = self._total_length / n_docs
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query_text)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for chunk_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    @classmethod
+    def from_collection(cls, collection: Any, **kwargs) -> "LexicalIndex":
+        """以一次批次查詢從向量集合建立詞彙索引"""
+        index = cls(**kwargs)
+        results = collection.get(include=["documents", "metadatas"])
+        if results and results["ids"]:
+            index.add(results["ids"], results["documents"], results["metadatas"])
+        logger.info(f"建立詞彙索引：{len(index)} 個區塊")
+        return index
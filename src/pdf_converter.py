@@ -0,0 +1,220 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import json
+import asyncio
+from loguru import logger
+from .metrics import STAGE_SECONDS, GEMINI_ERRORS
+from .tracing import span
+
+PAGE_PROMPT = """
+分析提供的 PDF 圖片中的表格並轉換為 JSON 格式。這些圖片是 PDF 文件中連續的第 {first_page} 到第 {last_page} 頁。
+
+指示：
+1. 如果同一個表格跨越這些頁面，請將它們合併為一個完整的表格。
+2. 如果有多個不同的表格，請為每個不同的表格建立獨立的物件，依頁面中出現的順序排列。
+3. 回傳的內容應為包含表格物件的 JSON 陣列。每個表格物件應包含：
+   - "table_id"：每個不同表格的唯一識別碼
+   - "data"：以欄位標題為鍵值的表格資料陣列；如果表格沒有標題列（例如延續前一頁的表格），
+     請依欄位順序使用 "column_1"、"column_2" 等作為鍵值
+   - "continued_from_previous"：表格是否從第一頁頂端開始且沒有標題，看起來是前一頁表格的延續
+   - "continues_on_next"：表格是否在最後一頁底端被截斷，看起來會延續到下一頁
+4. 請使用正體中文（繁體中文）輸出
+
+只回傳 JSON 資料，不要包含其他文字。
+"""
+
+
+def parse_json_response(text: str) -> Any:
+    """
+    解析 Gemini 回應中的 JSON，容許前後的程式碼區塊標記或說明文字
+
+    Args:
+        text: 回應文字
+
+    Returns:
+        解析後的 JSON 資料
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    clean_text = text.strip().strip("`").strip()
+    if clean_text.startswith("json"):
+        clean_text = clean_text[4:]
+    # 尋找 JSON 陣列或物件的起始和結束位置
+    for open_char, close_char in (("[", "]"), ("{", "}")):
+        start_idx = clean_text.find(open_char)
+        end_idx = clean_text.rfind(close_char) + 1
+        if start_idx != -1 and end_idx > start_idx:
+            try:
+                return json.loads(clean_text[start_idx:end_idx])
+            except json.JSONDecodeError:
+                continue
+    raise ValueError(f"無法解析回應為 JSON，回應內容：{text}")
+
+
+def _columns(rows: List[Any]) -> List[str]:
+    """表格的欄位（第一列的鍵值順序）"""
+    return list(rows[0].keys()) if rows and isinstance(rows[0], dict) else []
+
+
+def _is_positional(columns: List[str]) -> bool:
+    return bool(columns) and all(column == f"column_{i + 1}" for i, column in enumerate(columns))
+
+
+def stitch_tables(groups: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    依頁面順序合併各頁面群組的表格，把跨越群組邊界的表格接回前一個表格
+
+    前一群組最後一個表格標記 continues_on_next，或本群組第一個表格標記
+    continued_from_previous，且兩者欄位相同（或本群組的表格沒有標題、欄位數相同）
+    時視為同一個表格。
+
+    Args:
+        groups: 各頁面群組依序解析出的表格物件列表
+
+    Returns:
+        合併後的表格列表，每個表格包含 table_id 與 data
+    """
+    tables: List[Dict[str, Any]] = []
+    previous_continues = False
+    for group in groups:
+        for index, table in enumerate(group):
+            rows = table.get("data", [])
+            if not isinstance(rows, list):
+                rows = [rows]
+            continued = bool(table.get("continued_from_previous"))
+            if index == 0 and tables and (continued or previous_continues):
+                last_rows = tables[-1]["data"]
+                last_columns, columns = _columns(last_rows), _columns(rows)
+                if columns == last_columns:
+                    last_rows.extend(rows)
+                    continue
+                if last_columns and _is_positional(columns) and len(columns) == len(last_columns):
+                    last_rows.extend(
+                        {name: row.get(column) for name, column in zip(last_columns, columns)} for row in rows
+                    )
+                    continue
+            tables.append({"table_id": f"table_{len(tables) + 1}", "data": list(rows)})
+        previous_continues = bool(group and group[-1].get("continues_on_next"))
+    return tables
+
+
+class PdfTableConverter:
+    """
+    以頁面群組為單位的 PDF 表格擷取流程
+
+    每個群組在取得並行額度後才點陣化該群組的頁面，送出後即釋放圖片，
+    記憶體用量上限約為 max_concurrency × pages_per_group 頁，不隨總頁數增加。
+    各群組在執行緒中並行呼叫 Gemini，完成後依頁面順序合併跨群組的表格。
+    Gemini 使用同步呼叫，轉換器可在任何事件迴圈中執行（例如背景工作執行緒中的 asyncio.run）。
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        dpi: int = 150,
+        pages_per_group: int = 2,
+        max_concurrency: int = 4,
+        max_pages: int = 50
+    ):
+        """
+        初始化 PDF 表格轉換器
+
+        Args:
+            model: Gemini 模型
+            dpi: 點陣化解析度
+            pages_per_group: 每次送給 Gemini 的頁數
+            max_concurrency: 同時處理的群組數
+            max_pages: 接受的最大頁數
+        """
+        self.model = model
+        self.dpi = dpi
+        self.pages_per_group = max(1, pages_per_group)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_pages = max_pages
+
+    def page_count(self, pdf_path: str) -> int:
+        """讀取 PDF 頁數，不需點陣化"""
+        from pdf2image import pdfinfo_from_path
+
+        return int(pdfinfo_from_path(str(pdf_path))["Pages"])
+
+    def page_groups(self, page_count: int) -> List[Tuple[int, int]]:
+        """依 pages_per_group 切分頁面範圍（頁碼從 1 開始，包含兩端）"""
+        return [
+            (first, min(first + self.pages_per_group - 1, page_count))
+            for first in range(1, page_count + 1, self.pages_per_group)
+        ]
+
+    def _rasterize(self, pdf_path: str, first_page: int, last_page: int) -> List[Any]:
+        from pdf2image import convert_from_path
+
+        with STAGE_SECONDS.time(stage="convert_rasterize"):
+            return convert_from_path(str(pdf_path), dpi=self.dpi, first_page=first_page, last_page=last_page)
+
+    async def _convert_group(self, pdf_path: str, first_page: int, last_page: int, semaphore: asyncio.Semaphore) -> List[Dict[str, Any]]:
+        """點陣化並擷取單一頁面群組的表格"""
+        async with semaphore:
+            with span("pdf.page_group", first_page=first_page, last_page=last_page):
+                with span("pdf.rasterize"):
+                    images = await asyncio.to_thread(self._rasterize, pdf_path, first_page, last_page)
+                prompt = PAGE_PROMPT.format(first_page=first_page, last_page=last_page)
+                try:
+                    with STAGE_SECONDS.time(stage="convert_generate"), span("gemini.generate"):
+                        response = await asyncio.to_thread(self.model.generate_content, [prompt] + images)
+                except Exception:
+                    GEMINI_ERRORS.inc(operation="convert")
+                    raise
+                finally:
+                    del images
+        result = parse_json_response(response.text)
+        if isinstance(result, dict):
+            result = [result]
+        return [table if isinstance(table, dict) and "data" in table else {"data": table} for table in result]
+
+    async def convert(
+        self,
+        pdf_path: str,
+        progress_callback: Optional[Callable[[int, int], None]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        擷取 PDF 中的所有表格
+
+        Args:
+            pdf_path: PDF 檔案路徑
+            progress_callback: 進度回呼，參數為（已完成頁面群組數，總群組數）
+
+        Returns:
+            表格列表，每個表格包含 table_id 與 data
+
+        Raises:
+            ValueError: 頁數超過 max_pages 或無法解析 Gemini 回應
+        """
+        page_count = await asyncio.to_thread(self.page_count, pdf_path)
+        if page_count > self.max_pages:
+            raise ValueError(f"PDF 頁數超過限制（最多 {self.max_pages} 頁）")
+
+        groups = self.page_groups(page_count)
+        logger.info(f"PDF 共 {page_count} 頁，分為 {len(groups)} 個頁面群組處理（DPI：{self.dpi}）")
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = [asyncio.create_task(self._convert_group(pdf_path, first, last, semaphore)) for first, last in groups]
+        if progress_callback is not None:
+            progress_callback(0, len(tasks))
+            done = 0
+
+            def report(_: asyncio.Task) -> None:
+                nonlocal done
+                done += 1
+                progress_callback(done, len(tasks))
+
+            for task in tasks:
+                task.add_done_callback(report)
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # 任一群組失敗時取消其餘群組，避免繼續呼叫 Gemini
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return stitch_tables(results)
@@ -0,0 +1,92 @@
+from typing import List, Optional
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import numpy as np
+from loguru import logger
+from .metrics import TIMEOUTS
+
+
+class Reranker:
+    """
+    以 CPU cross-encoder 對檢索候選重新評分
+
+    所有候選在同一批次中評分，並受時間預算限制；超過預算或評分器忙碌時
+    回傳 None，由呼叫端沿用原本的排序。分數為 sigmoid(logit) 的相關機率（0-1），
+    不依查詢正規化，可直接與固定閾值比較。
+    """
+
+    def __init__(self, model_name: str, time_budget_ms: float = 300, max_workers: int = 1):
+        """
+        初始化重排序器
+
+        Args:
+            model_name: cross-encoder 模型名稱
+            time_budget_ms: 單次重排序的時間預算（毫秒）
+            max_workers: 同時進行的重排序數
+        """
+        import torch
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, max_length=512)
+        # 取得原始 logit，由 _relevance 統一轉換，不依模型設定的預設激活函數
+        self._identity = torch.nn.Identity()
+        self.time_budget = time_budget_ms / 1000.0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rerank")
+        self._slots = threading.BoundedSemaphore(max_workers)
+        logger.info(f"載入重排序模型：{model_name}")
+
+    def _submit(self, query_text: str, documents: List[str]) -> Optional[Future]:
+        """提交評分工作；所有評分執行緒都在忙碌時回傳 None"""
+        if not self._slots.acquire(blocking=False):
+            logger.warning("重排序器忙碌中，沿用原始排序")
+            return None
+        future = self._executor.submit(
+            self.model.predict,
+            [(query_text, document) for document in documents],
+            batch_size=len(documents),
+            show_progress_bar=False,
+            activation_fct=self._identity
+        )
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    @staticmethod
+    def _relevance(logits: object) -> np.ndarray:
+        """將 cross-encoder 的 logit 轉換為 0-1 的相關機率"""
+        return 1.0 / (1.0 + np.exp(-np.asarray(logits, dtype=np.float32)))
+
+    def rerank(self, query_text: str, documents: List[str]) -> Optional[np.ndarray]:
+        """
+        同步計算候選區塊的相關性分數
+
+        Args:
+            query_text: 查詢文字
+            documents: 候選文字區塊
+
+        Returns:
+            相關機率陣列，超過時間預算時回傳 None
+        """
+        future = self._submit(query_text, documents)
+        if future is None:
+            return None
+        try:
+            return self._relevance(future.result(timeout=self.time_budget))
+        except FutureTimeoutError:
+            logger.warning(f"重排序超過時間預算 {self.time_budget * 1000:.0f} ms，沿用原始排序")
+            TIMEOUTS.inc(operation="rerank")
+            return None
+
+    async def arerank(self, query_text: str, documents: List[str]) -> Optional[np.ndarray]:
+        """rerank 的非同步版本，不阻塞事件迴圈"""
+        future = self._submit(query_text, documents)
+        if future is None:
+            return None
+        try:
+            # shield 讓逾時後評分仍可在背景完成並釋放執行緒
+            scores = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=self.time_budget)
+            return self._relevance(scores)
+        except asyncio.TimeoutError:
+            logger.warning(f"重排序超過時間預算 {self.time_budget * 1000:.0f} ms，沿用原始排序")
+            TIMEOUTS.inc(operation="rerank")
+            return None
@@ -3,25 +3,31 @@ import os
 import yaml
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import uvicorn
-from .improved_rag_system import ImprovedRAGSystem
-import google.generativeai as genai
-from PIL import Image
-import pandas as pd
-from pdf2image import convert_from_path
+from .jobs import JobManager
+from .warmup import BackgroundLoader, file_lock
+from .activity_log import ActivityLogWriter
+from .pdf_converter import PdfTableConverter
+from .tracing import setup_tracing, shutdown_tracing, span, traced
+from .metrics import (
+    REGISTRY, CONTENT_TYPE, STAGE_SECONDS, REQUEST_SECONDS, GEMINI_ERRORS, TIMEOUTS, COLLECTION_SIZE, QUEUE_DEPTH, timed
+)
 import json
 import traceback
 from pathlib import Path
 import shutil
 import time
 import asyncio
+import threading
+import uuid
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
 import logging
 from datetime import datetime
+from functools import lru_cache
 
 # 配置日誌
 logging.basicConfig(level=logging.INFO)
@@ -31,9 +37,14 @@ logger = logging.getLogger(__name__)
 with open("config.yaml", "r", encoding="utf-8") as f:
     config = yaml.safe_load(f)
 
-# 初始化 Gemini 模型
-genai.configure(api_key=config["gemini"]["api_key"])
-model = genai.GenerativeModel("gemini-1.5-flash")
+
+@lru_cache(maxsize=1)
+def get_vision_model():
+    """取得表格轉換用的 Gemini 模型，首次使用時才載入"""
+    import google.generativeai as genai
+
+    genai.configure(api_key=config["gemini"]["api_key"])
+    return genai.GenerativeModel("gemini-1.5-flash")
 
 # 初始化 FastAPI 應用
 app = FastAPI(title="RAG System API", root_path="/app/demo/rag")
@@ -42,21 +53,31 @@ app = FastAPI(title="RAG System API", root_path="/app/demo/rag")
 # 超時中間件
 class TimeoutMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next) -> Response:
+        start = time.perf_counter()
         try:
             # 設置 60 秒超時
             response = await asyncio.wait_for(call_next(request), timeout=60.0)
-            return response
         except asyncio.TimeoutError:
             logger.error(f"Request timeout: {request.url}")
-            return JSONResponse(status_code=504, content={"detail": "請求處理超時，請稍後重試"})
+            TIMEOUTS.inc(operation="request")
+            response = JSONResponse(status_code=504, content={"detail": "請求處理超時，請稍後重試"})
         except Exception as e:
             logger.error(f"Error processing request: {str(e)}")
-            return JSONResponse(status_code=500, content={"detail": "處理請求時發生錯誤"})
+            response = JSONResponse(status_code=500, content={"detail": "處理請求時發生錯誤"})
+        # 以路由樣板作為標籤，避免路徑參數與靜態檔案造成過多時間序列
+        route = getattr(request.scope.get("route"), "path", "other")
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start, method=request.method, route=route, status=str(response.status_code)
+        )
+        return response
 
 
 # 添加中間件
 app.add_middleware(TimeoutMiddleware)
 
+# 選用的 OpenTelemetry 追蹤
+setup_tracing(app, config)
+
 # 設定 CORS
 app.add_middleware(
     CORSMiddleware,
@@ -66,8 +87,83 @@ app.add_middleware(
     allow_headers=["*", "X-Device-ID", "X-User-Name"],  # 明確允許自定義請求頭
 )
 
-# 初始化 RAG 系統
-rag_system = ImprovedRAGSystem()
+# RAG 系統在背景載入，服務啟動後立即可以接受請求
+startup_config = config.get("startup", {})
+
+
+def create_rag_system():
+    from .improved_rag_system import ImprovedRAGSystem
+
+    return ImprovedRAGSystem()
+
+
+def warm_up_rag_system(system) -> None:
+    """預熱查詢嵌入，並只重新索引新增或內容變更的文件"""
+    system.embed_text("預熱")
+    # 多 worker 部署時只由取得鎖的 worker 同步
+    with file_lock(startup_config.get("ingest_lock", "data/ingest.lock")) as acquired:
+        if not acquired:
+            print("其他 worker 正在同步文件目錄，略過")
+            return
+        changed = system.sync_directory("docs", config["upload"]["allowed_extensions"])
+        for filename in changed:
+            print(f"載入新文件或更新的文件：{filename}")
+        for filename in system.purge_orphans("docs"):
+            print(f"移除已刪除文件的索引：{filename}")
+
+
+rag_loader = BackgroundLoader(create_rag_system, warmup=warm_up_rag_system, name="RAG 系統")
+COLLECTION_SIZE.set_function(lambda: rag_loader.value.collection.count() if rag_loader.ready else None)
+
+
+async def get_rag_system():
+    """取得 RAG 系統，載入中時最多等待 startup.wait_timeout 秒"""
+    try:
+        return await rag_loader.aget(timeout=startup_config.get("wait_timeout", 10))
+    except TimeoutError:
+        raise HTTPException(status_code=503, detail="系統啟動中，請稍後重試", headers={"Retry-After": "5"})
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+# 文件索引工作佇列
+ingestion_jobs = JobManager(max_workers=config.get("ingestion", {}).get("queue_workers", 2), name="ingest")
+QUEUE_DEPTH.set_function(ingestion_jobs.queue_depth, queue="ingest")
+
+# 表格轉換工作佇列，點陣化、Gemini 呼叫與輸出都在此執行，不佔用事件迴圈
+convert_jobs = JobManager(max_workers=config.get("convert", {}).get("workers", 2), name="convert")
+QUEUE_DEPTH.set_function(convert_jobs.queue_depth, queue="convert")
+
+
+async def purge_orphans_periodically(interval: float) -> None:
+    """定期清除來源檔案已不在 docs/ 中的區塊（例如直接從磁碟刪除的文件）"""
+    while True:
+        await asyncio.sleep(interval)
+        if not rag_loader.ready:
+            continue
+        try:
+            # 多 worker 部署時只由取得鎖的 worker 清除
+            with file_lock(startup_config.get("ingest_lock", "data/ingest.lock")) as acquired:
+                if acquired:
+                    await asyncio.to_thread(rag_loader.value.purge_orphans, "docs")
+        except Exception as e:
+            logger.error(f"清除孤立區塊失敗：{str(e)}")
+
+
+async def refresh_lexical_periodically(interval: float) -> None:
+    """定期重建 BM25 詞彙索引，納入其他 worker 匯入或刪除的文件"""
+    while True:
+        await asyncio.sleep(interval)
+        if not rag_loader.ready:
+            continue
+        try:
+            await asyncio.to_thread(rag_loader.value.refresh_lexical_index)
+        except Exception as e:
+            logger.error(f"重建詞彙索引失敗：{str(e)}")
+
+
+purge_task: Optional[asyncio.Task] = None
+lexical_refresh_task: Optional[asyncio.Task] = None
+output_cleanup_task: Optional[asyncio.Task] = None
 
 
 # 請求/回應模型
@@ -122,10 +218,44 @@ async def list_documents():
 
 
 # 用戶訪問記錄
-async def log_user_activity(request: Request, action: str, details: Optional[Dict] = None):
-    """記錄用戶活動"""
+activity_config = config.get("activity_log", {})
+activity_log = ActivityLogWriter(
+    log_dir=activity_config.get("path", "logs"),
+    max_queue=activity_config.get("max_queue", 10000),
+    batch_size=activity_config.get("batch_size", 200),
+    flush_interval=activity_config.get("flush_interval", 1.0),
+    drop_policy=activity_config.get("drop_policy", "drop_newest"),
+)
+QUEUE_DEPTH.set_function(activity_log.queue_depth, queue="activity_log")
+
+# /log_visit 只記錄這些請求頭，避免寫入 Cookie 等敏感資訊
+VISIT_HEADERS = ("referer", "accept-language", "x-forwarded-for", "x-real-ip")
+
+
+# 信任其 X-Forwarded-For / X-Real-IP 標頭的反向代理位址
+TRUSTED_PROXIES = set(config["server"].get("trusted_proxies", ["127.0.0.1", "::1"]))
+
+
+def client_address(request: Request) -> str:
+    """
+    取得用戶端位址；連線來自信任的反向代理時改用代理轉送的位址
+
+    X-Forwarded-For 由右往左略過信任的代理，取第一個非代理的位址，用戶端自行偽造的左側項目不會被採用。
+    """
+    host = request.client.host if request.client else "unknown"
+    if host not in TRUSTED_PROXIES:
+        return host
+    forwarded = [item.strip() for item in request.headers.get("x-forwarded-for", "").split(",") if item.strip()]
+    for address in reversed(forwarded):
+        if address not in TRUSTED_PROXIES:
+            return address
+    return request.headers.get("x-real-ip", host)
+
+
+def log_user_activity(request: Request, action: str, details: Optional[Dict] = None):
+    """記錄用戶活動（放入背景寫入佇列，不等待磁碟 I/O）"""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    client_host = request.client.host
+    client_host = client_address(request)
     user_agent = request.headers.get("user-agent", "unknown")
 
     log_entry = {
@@ -136,10 +266,7 @@ async def log_user_activity(request: Request, action: str, details: Optional[Dic
         "details": details or {},
     }
 
-    # 寫入日誌文件
-    log_file = f"logs/user_activity_{datetime.now().strftime('%Y-%m-%d')}.log"
-    with open(log_file, "a", encoding="utf-8") as f:
-        f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
+    activity_log.log(log_entry)
 
 
 @app.post("/query", response_model=Answer)
@@ -147,7 +274,7 @@ async def query(request: Request, question: Question, background_tasks: Backgrou
     """查詢文件"""
     try:
         # 記錄查詢活動
-        await log_user_activity(
+        log_user_activity(
             request, "query", {"question": question.text, "similarity_threshold": question.similarity_threshold}
         )
 
@@ -158,7 +285,12 @@ async def query(request: Request, question: Question, background_tasks: Backgrou
             max_threshold = config["server"]["similarity_settings"]["max_threshold"]
             threshold = max(min_threshold, min(max_threshold, threshold))
 
-        result = await asyncio.wait_for(asyncio.to_thread(rag_system.query, question.text, threshold), timeout=30.0)
+        rag_system = await get_rag_system()
+        try:
+            result = await asyncio.wait_for(rag_system.aquery(question.text, threshold), timeout=30.0)
+        except asyncio.TimeoutError:
+            TIMEOUTS.inc(operation="query")
+            raise HTTPException(status_code=504, detail="查詢處理超時，請稍後重試")
 
         return Answer(
             answer=result["answer"],
@@ -167,19 +299,46 @@ async def query(request: Request, question: Question, background_tasks: Backgrou
         )
     except Exception as e:
         # 記錄錯誤
-        await log_user_activity(request, "query_error", {"error": str(e), "question": question.text})
+        log_user_activity(request, "query_error", {"error": str(e), "question": question.text})
         raise
 
 
+@app.post("/query/stream")
+async def query_stream(request: Request, question: Question):
+    """以 Server-Sent Events 串流回傳查詢結果：先送出來源，再逐段送出答案"""
+    log_user_activity(
+        request, "query_stream", {"question": question.text, "similarity_threshold": question.similarity_threshold}
+    )
+
+    threshold = question.similarity_threshold
+    if threshold is not None:
+        min_threshold = config["server"]["similarity_settings"]["min_threshold"]
+        max_threshold = config["server"]["similarity_settings"]["max_threshold"]
+        threshold = max(min_threshold, min(max_threshold, threshold))
+
+    rag_system = await get_rag_system()
+
+    async def event_stream():
+        async for event in rag_system.astream_query(question.text, threshold):
+            yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/upload")
 async def upload_document(request: Request, file: UploadFile = File(...), password: str = Form(...)):
     """上傳新文件（需要管理員密碼）"""
     try:
         # 記錄上傳活動
-        await log_user_activity(request, "upload", {"filename": file.filename})
+        log_user_activity(request, "upload", {"filename": file.filename})
 
         # 原有的上傳邏輯
         verify_password(password)
+        rag_system = await get_rag_system()
 
         # 檢查檔案大小
         file_size = 0
@@ -196,26 +355,36 @@ async def upload_document(request: Request, file: UploadFile = File(...), passwo
 
         # 儲存檔案
         file_path = os.path.join("docs", file.filename)
-        with open(file_path, "wb") as f:
-            f.write(content)
+        with span("docs.write", bytes=len(content)):
+            await asyncio.to_thread(Path(file_path).write_bytes, content)
 
-        # 新增到 RAG 系統
-        with open(file_path, "r", encoding="utf-8") as f:
-            text = f.read()
-            rag_system.add_document(text, {"source": file.filename})
+        # 在背景建立索引，立即回傳工作 ID
+        text = content.decode("utf-8")
+        job = ingestion_jobs.submit("ingest", rag_system.add_documents, [(text, {"source": file.filename})])
 
-        return JSONResponse(content={"message": "檔案上傳成功"})
+        return JSONResponse(content={"message": "檔案上傳成功，正在建立索引", "job_id": job.id})
     except Exception as e:
-        await log_user_activity(request, "upload_error", {"filename": file.filename, "error": str(e)})
+        log_user_activity(request, "upload_error", {"filename": file.filename, "error": str(e)})
         raise
 
 
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """查詢背景工作的狀態與進度"""
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="工作不存在")
+    return job.to_dict()
+
+
 @app.delete("/documents/{filename}")
 async def delete_document(request: Request, filename: str, password: str = Depends(verify_password)):
     """刪除文件（需要管理員密碼）"""
     try:
         # 記錄刪除活動
-        await log_user_activity(request, "delete", {"filename": filename})
+        log_user_activity(request, "delete", {"filename": filename})
+
+        rag_system = await get_rag_system()
 
         # 原有的刪除邏輯
         file_path = os.path.join("docs", filename)
@@ -223,10 +392,11 @@ async def delete_document(request: Request, filename: str, password: str = Depen
             raise HTTPException(status_code=404, detail="檔案不存在")
 
         os.remove(file_path)
-        # TODO: 從 RAG 系統中移除文件
-        return JSONResponse(content={"message": "檔案刪除成功"})
+        # 從 RAG 系統中移除文件的所有區塊，並更新詞彙索引與答案快取
+        removed = await asyncio.to_thread(rag_system.delete_document, filename)
+        return JSONResponse(content={"message": "檔案刪除成功", "removed_chunks": removed})
     except Exception as e:
-        await log_user_activity(request, "delete_error", {"filename": filename, "error": str(e)})
+        log_user_activity(request, "delete_error", {"filename": filename, "error": str(e)})
         raise
 
 
@@ -246,6 +416,8 @@ async def get_document_content(filename: str):
 
 
 def process_image(model, image):
+    from PIL import Image
+
     # 載入並準備圖片
     if isinstance(image, (str, Path)):
         img = Image.open(str(image))
@@ -263,7 +435,12 @@ def process_image(model, image):
 
     try:
         # 產生 Gemini 回應
-        response = model.generate_content([prompt, img])
+        try:
+            with STAGE_SECONDS.time(stage="convert_generate"), span("gemini.generate"):
+                response = model.generate_content([prompt, img])
+        except Exception:
+            GEMINI_ERRORS.inc(operation="convert")
+            raise
 
         # 清理回應文字
         clean_text = response.text.strip()
@@ -291,85 +468,28 @@ def process_image(model, image):
         raise HTTPException(status_code=500, detail=f"處理圖片時發生錯誤：{str(e)}")
 
 
-def process_pdf(model, pdf_path):
-    """
-    處理 PDF 檔案，先檢查頁數，如果超過 5 頁則拒絕處理，
-    否則將所有頁面一次送到 Gemini 處理，讓 AI 自動整合跨頁的表格
+def process_pdf(model, pdf_path, progress_callback=None):
     """
-    # 轉換 PDF 到圖片並檢查頁數
-    images = convert_from_path(pdf_path)
+    處理 PDF 檔案：依頁面群組逐步點陣化並並行送到 Gemini，最後合併跨頁的表格
 
-    # 檢查頁數限制
-    if len(images) > 5:
-        return {"error": "PDF 頁數超過限制（最多 5 頁）", "page_count": len(images)}
-
-    # 將所有頁面整合為一個請求
-    prompt = """
-    分析提供的 PDF 圖片中的表格並轉換為 JSON 格式。這些圖片是 PDF 文件的多個頁面。
-    
-    指示：
-    1. 如果同一個表格跨越多個頁面，請將它們合併為一個完整的表格。
-    2. 如果有多個不同的表格，請為每個不同的表格建立獨立的 JSON 陣列。
-    3. 回傳的內容應為包含表格物件的 JSON 陣列。每個表格物件應包含：
-       - "table_id"：每個不同表格的唯一識別碼
-       - "data"：以欄位標題為鍵值的表格資料陣列
-    
-    只回傳 JSON 資料，不要包含其他文字。
+    在轉換工作執行緒中以獨立的事件迴圈執行，不佔用服務的事件迴圈
     """
-
-    # 產生 Gemini 回應
+    convert_config = config.get("convert", {})
+    converter = PdfTableConverter(
+        model,
+        dpi=convert_config.get("dpi", 150),
+        pages_per_group=convert_config.get("pages_per_group", 2),
+        max_concurrency=convert_config.get("max_concurrency", 4),
+        max_pages=convert_config.get("max_pages", 50)
+    )
     try:
-        # 將所有圖片一次送到 Gemini
-        response = model.generate_content([prompt] + images)
-
-        # 解析 JSON 結果
-        try:
-            # 嘗試直接解析回應文字為 JSON
-            json_data = json.loads(response.text)
-            return json_data
-        except json.JSONDecodeError:
-            # 如果直接解析失敗，嘗試擷取 JSON 內容
-            clean_text = response.text.strip("`").strip()
-            if clean_text.startswith("json"):
-                clean_text = clean_text[4:]
-            try:
-                # 尋找 JSON 陣列的起始和結束位置
-                start_idx = clean_text.find("[")
-                end_idx = clean_text.rfind("]") + 1
-                json_content = clean_text[start_idx:end_idx]
-                json_data = json.loads(json_content)
-                return json_data
-            except json.JSONDecodeError as e:
-                raise Exception(f"無法解析回應為 JSON：{e}\n回應內容：{response.text}")
+        return asyncio.run(converter.convert(pdf_path, progress_callback))
     except Exception as e:
         return {"error": f"處理 PDF 時發生錯誤：{str(e)}"}
 
 
-async def save_table_formats(data, base_name, output_dir):
-    """將表格資料儲存為多種格式並回傳 URLs"""
-
-    # 儲存 JSON 結果
-    json_filename = f"{base_name}.json"
-    json_output_path = output_dir / json_filename
-    with json_output_path.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-    # 儲存 CSV 結果
-    csv_filename = f"{base_name}.csv"
-    csv_output_path = output_dir / csv_filename
-    df = pd.DataFrame(data)
-    df.to_csv(csv_output_path, index=False)
-
-    # 儲存 Excel 結果
-    excel_filename = f"{base_name}.xlsx"
-    excel_output_path = output_dir / excel_filename
-    df.to_excel(excel_output_path, index=False)
-
-    # 儲存純文字結果
-    text_filename = f"{base_name}.txt"
-    text_output_path = output_dir / text_filename
-
-    # 將 JSON 資料轉換為易讀的文字格式
+def render_table_text(data) -> str:
+    """將 JSON 表格資料轉換為易讀的文字格式"""
     text_content = []
     if isinstance(data, list):
         for item in data:
@@ -382,49 +502,175 @@ async def save_table_formats(data, base_name, output_dir):
     elif isinstance(data, dict):
         for key, value in data.items():
             text_content.append(f"{key}: {value}")
+    return "\n".join(text_content)
 
-    # 寫入文字檔
-    with text_output_path.open("w", encoding="utf-8") as f:
-        f.write("\n".join(text_content))
+
+@timed("convert_write")
+@traced("output.write")
+def save_table_formats(data, base_name, output_dir):
+    """
+    只儲存 JSON 格式，CSV、Excel 與純文字檔在第一次下載時才由 JSON 產生
+
+    Returns:
+        各格式的 URLs 與純文字內容
+    """
+    # 儲存 JSON 結果（唯一的正本），同名重新轉換時刪除由舊 JSON 產生的衍生檔
+    json_filename = f"{base_name}.json"
+    json_output_path = output_dir / json_filename
+    with json_output_path.open("w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    for suffix in EXPORT_FORMATS:
+        (output_dir / f"{base_name}{suffix}").unlink(missing_ok=True)
 
     # 回傳相對於伺服器的路徑和純文字內容
     return {
         "name": base_name,
         "json": f"./output/{json_filename}",
-        "csv": f"./output/{csv_filename}",
-        "excel": f"./output/{excel_filename}",
-        "text": f"./output/{text_filename}",
-        "text_content": "\n".join(text_content),  # 添加純文字內容
+        "csv": f"./output/{base_name}.csv",
+        "excel": f"./output/{base_name}.xlsx",
+        "text": f"./output/{base_name}.txt",
+        "text_content": render_table_text(data),  # 添加純文字內容
     }
 
 
-@app.post("/convert")
-async def convert_file(request: Request, file: UploadFile = File(...)):
-    """處理上傳的圖片或 PDF 檔案並轉換為表格資料"""
+EXPORT_FORMATS = (".csv", ".xlsx", ".txt")
+export_locks: Dict[str, threading.Lock] = {}
+export_locks_guard = threading.Lock()
+
+
+@timed("convert_export")
+@traced("output.export")
+def export_table(json_path: Path, export_path: Path) -> None:
+    """
+    由 JSON 正本產生 CSV、Excel 或純文字檔，先寫入暫存檔再改名，避免下載到寫入一半的檔案
+
+    衍生檔的修改時間設為讀取時 JSON 的修改時間，JSON 之後被改寫時兩者不同，get_export 會重新產生。
+    """
+    json_stat = json_path.stat()
+    with json_path.open("r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    tmp_path = export_path.with_name(f".{export_path.stem}.{uuid.uuid4().hex}{export_path.suffix}")
     try:
-        # 記錄轉換活動
-        await log_user_activity(request, "convert", {"filename": file.filename})
+        if export_path.suffix == ".txt":
+            tmp_path.write_text(render_table_text(data), encoding="utf-8")
+        else:
+            import pandas as pd
 
-        # 原有的轉換邏輯
-        # 儲存上傳的檔案
-        upload_dir = Path("uploads")
-        upload_dir.mkdir(exist_ok=True)
-        file_path = upload_dir / file.filename
+            df = pd.DataFrame(data)
+            if export_path.suffix == ".csv":
+                df.to_csv(tmp_path, index=False)
+            else:
+                df.to_excel(tmp_path, index=False)
+        os.utime(tmp_path, ns=(json_stat.st_atime_ns, json_stat.st_mtime_ns))
+        os.replace(tmp_path, export_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def get_export(filename: str) -> Optional[Path]:
+    """
+    取得輸出檔案，CSV、Excel 與純文字檔不存在或與 JSON 的修改時間不符時由同名的 JSON 產生並保留
+
+    Returns:
+        檔案路徑，JSON 正本不存在時回傳 None
+    """
+    output_dir = Path("output")
+    path = output_dir / filename
+    if path.suffix not in EXPORT_FORMATS:
+        return path if path.is_file() else None
+
+    json_path = path.with_suffix(".json")
+    with export_locks_guard:
+        lock = export_locks.setdefault(filename, threading.Lock())
+    try:
+        # 同一檔案的並行下載只產生一次
+        with lock:
+            if not json_path.is_file():
+                return None
+            if path.is_file() and path.stat().st_mtime_ns == json_path.stat().st_mtime_ns:
+                return path
+            export_table(json_path, path)
+            return path
+    finally:
+        with export_locks_guard:
+            export_locks.pop(filename, None)
+
+
+def cleanup_output(ttl: float) -> int:
+    """
+    刪除 JSON 正本超過 ttl 秒的轉換結果及其衍生檔，以及 JSON 已不存在的衍生檔
+
+    Returns:
+        刪除的檔案數
+    """
+    output_dir = Path("output")
+    now = time.time()
+    removed = 0
+    for path in output_dir.iterdir():
+        if not path.is_file():
+            continue
+        json_path = path.with_suffix(".json")
+        try:
+            if path.name.startswith("."):
+                # 產生中的暫存檔只依自身的修改時間判斷
+                expired = now - path.stat().st_mtime > ttl
+            else:
+                expired = not json_path.exists() or now - json_path.stat().st_mtime > ttl
+            # 衍生檔與 JSON 一起到期，JSON 最後刪除
+            if expired and path.suffix != ".json":
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            continue
+    for path in output_dir.glob("*.json"):
+        try:
+            if now - path.stat().st_mtime > ttl:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
 
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
 
+async def cleanup_output_periodically(ttl: float, interval: float) -> None:
+    """定期清除過期的轉換結果"""
+    while True:
+        try:
+            removed = await asyncio.to_thread(cleanup_output, ttl)
+            if removed:
+                print(f"已清除 {removed} 個過期的轉換結果檔案")
+        except Exception as e:
+            logger.error(f"清除轉換結果失敗：{str(e)}")
+        await asyncio.sleep(interval)
+
+
+def run_conversion(file_path: Path, name: str, progress_callback=None):
+    """
+    轉換工作：擷取表格並輸出各種格式，在轉換工作執行緒中執行
+
+    Args:
+        file_path: 上傳檔案的暫存路徑
+        name: 原始檔名（不含副檔名），作為輸出檔名的前綴
+        progress_callback: 進度回呼
+
+    Returns:
+        {"tables": [...]} 轉換結果
+    """
+    try:
         output_dir = Path("output")
         output_dir.mkdir(exist_ok=True)
 
         # 處理檔案
-        if file.filename.lower().endswith((".pdf", ".PDF")):
+        model = get_vision_model()
+        if file_path.suffix.lower() == ".pdf":
             # 處理 PDF 檔案
-            result = process_pdf(model, file_path)
+            result = process_pdf(model, file_path, progress_callback)
 
             # 檢查是否有錯誤訊息（例如頁數過多）
             if isinstance(result, dict) and "error" in result:
-                return JSONResponse(status_code=400, content={"error": result["error"]})
+                raise ValueError(result["error"])
 
             # 處理結果
             tables_output = []
@@ -437,57 +683,157 @@ async def convert_file(request: Request, file: UploadFile = File(...)):
                     table_data = table.get("data", table)  # 如果沒有 data 欄位，就使用整個表
 
                     # 產生檔名
-                    base_name = f"{file_path.stem}_{table_id}"
+                    base_name = f"{name}_{table_id}"
 
                     # 儲存各種格式
-                    tables_output.append(await save_table_formats(table_data, base_name, output_dir))
+                    tables_output.append(save_table_formats(table_data, base_name, output_dir))
             else:
                 # 單一表格的情況
-                base_name = f"{file_path.stem}"
-                tables_output.append(await save_table_formats(result, base_name, output_dir))
+                tables_output.append(save_table_formats(result, name, output_dir))
+
+            return {"tables": tables_output}
+
+        # 處理單一圖片
+        if progress_callback is not None:
+            progress_callback(0, 1)
+        json_data = process_image(model, file_path)
+        table_output = save_table_formats(json_data, name, output_dir)
+        if progress_callback is not None:
+            progress_callback(1, 1)
+        return {"tables": [table_output]}
+    except HTTPException as e:
+        raise RuntimeError(e.detail) from e
+    finally:
+        # 清理上傳的檔案
+        if file_path.exists():
+            file_path.unlink()
 
-            # 回傳處理結果
-            return JSONResponse(content={"tables": tables_output})
 
-        else:
-            # 處理單一圖片
-            json_data = process_image(model, file_path)
-            base_name = f"{file_path.stem}"
-            table_output = await save_table_formats(json_data, base_name, output_dir)
+# 各用戶端進行中的轉換數
+active_conversions: Dict[str, int] = {}
+active_conversions_lock = threading.Lock()
+
+
+@app.post("/convert", status_code=202)
+@traced("convert")
+async def convert_file(request: Request, file: UploadFile = File(...)):
+    """接收圖片或 PDF 檔案並建立背景轉換工作，回傳工作 ID 供查詢進度與結果"""
+    # 經由反向代理時以轉送的用戶端位址計算上限，避免所有用戶端共用代理的位址
+    client_host = client_address(request)
+    limit = config.get("convert", {}).get("per_client_limit", 1)
+    with active_conversions_lock:
+        if active_conversions.get(client_host, 0) >= limit:
+            raise HTTPException(
+                status_code=429, detail=f"同時進行的轉換已達上限（{limit} 個），請稍後再試", headers={"Retry-After": "5"}
+            )
+        active_conversions[client_host] = active_conversions.get(client_host, 0) + 1
+
+    loop = asyncio.get_running_loop()
+
+    def release() -> None:
+        with active_conversions_lock:
+            active_conversions[client_host] -= 1
+            if not active_conversions[client_host]:
+                del active_conversions[client_host]
+
+    def job(progress_callback=None):
+        try:
+            with STAGE_SECONDS.time(stage="convert_total"):
+                return run_conversion(file_path, name, progress_callback)
+        except Exception as e:
+            loop.call_soon_threadsafe(
+                log_user_activity, request, "convert_error", {"filename": file.filename, "error": str(e)}
+            )
+            raise
+        finally:
+            release()
+
+    file_path: Optional[Path] = None
+    try:
+        # 記錄轉換活動
+        log_user_activity(request, "convert", {"filename": file.filename})
+
+        # 以隨機檔名儲存上傳的檔案，避免同名檔案的並行轉換互相覆寫
+        upload_dir = Path("uploads")
+        upload_dir.mkdir(exist_ok=True)
+        name = Path(file.filename).stem
+        file_path = upload_dir / f"{uuid.uuid4().hex}{Path(file.filename).suffix}"
 
-            # 回傳單頁結果
-            return JSONResponse(content={"tables": [table_output]})
+        def write_upload() -> None:
+            with file_path.open("wb") as buffer:
+                shutil.copyfileobj(file.file, buffer)
+
+        with span("uploads.write"):
+            await asyncio.to_thread(write_upload)
+
+        converting = convert_jobs.submit("convert", job)
     except Exception as e:
-        await log_user_activity(request, "convert_error", {"filename": file.filename, "error": str(e)})
+        release()
+        # 工作未建立時由這裡刪除已寫入的上傳檔
+        if file_path is not None:
+            file_path.unlink(missing_ok=True)
+        log_user_activity(request, "convert_error", {"filename": file.filename, "error": str(e)})
         print(f"處理檔案時發生錯誤：{str(e)}")
         print(traceback.format_exc())
         return JSONResponse(status_code=500, content={"error": f"處理檔案時發生錯誤：{str(e)}"})
-    finally:
-        # 清理上傳的檔案
-        if file_path.exists():
-            file_path.unlink()
 
+    return JSONResponse(status_code=202, content={"message": "檔案上傳成功，正在轉換", "job_id": converting.id})
 
-# 掛載靜態文件
-app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/output", StaticFiles(directory="output"), name="output")
-app.mount("/docs", StaticFiles(directory="docs"), name="docs")
 
-# 掛載根路徑的 HTML 檔案
-app.mount("/", StaticFiles(directory="static", html=True), name="html")
+@app.get("/convert/jobs/{job_id}")
+async def get_convert_job_status(job_id: str):
+    """查詢轉換工作的狀態、進度（已完成頁面群組數）與結果"""
+    job = convert_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="工作不存在")
+    return job.to_dict()
 
 
 # 健康檢查端點
 @app.get("/health")
 async def health_check():
-    """健康檢查端點"""
+    """健康檢查端點：載入中或已就緒時回傳 200 並附上就緒狀態，載入失敗時回傳 503"""
+    if rag_loader.error is not None:
+        return JSONResponse(status_code=503, content={
+            "status": "failed",
+            "live": True,
+            "ready": False,
+            "rag_system": rag_loader.status(),
+            "timestamp": time.time(),
+        })
+    return {
+        "status": "healthy" if rag_loader.ready else "starting",
+        "live": True,
+        "ready": rag_loader.ready,
+        "rag_system": rag_loader.status(),
+        "timestamp": time.time(),
+    }
+
+
+@app.get("/health/live")
+async def liveness_check():
+    """存活檢查：只要行程能處理請求即回傳 200"""
+    return {"status": "alive", "timestamp": time.time()}
+
+
+@app.get("/health/ready")
+async def readiness_check():
+    """就緒檢查：RAG 系統載入完成且向量資料庫可連線時回傳 200，否則回傳 503"""
+    if not rag_loader.ready:
+        return JSONResponse(status_code=503, content={"status": "starting", "rag_system": rag_loader.status()})
     try:
-        # 檢查 RAG 系統是否正常
-        rag_system.collection.get()
-        return {"status": "healthy", "timestamp": time.time()}
+        count = await asyncio.to_thread(rag_loader.value.collection.count)
     except Exception as e:
-        logger.error(f"Health check failed: {str(e)}")
-        raise HTTPException(status_code=503, detail="系統異常")
+        logger.error(f"Readiness check failed: {str(e)}")
+        return JSONResponse(status_code=503, content={"status": "unhealthy", "detail": "向量資料庫無法連線"})
+    return {"status": "ready", "chunks": count, "rag_system": rag_loader.status(), "timestamp": time.time()}
+
+
+@app.get("/metrics")
+async def metrics():
+    """以 Prometheus 文字格式輸出指標（多 worker 部署時為處理此請求的 worker 的指標）"""
+    body = await asyncio.to_thread(REGISTRY.render)
+    return Response(content=body, media_type=CONTENT_TYPE)
 
 
 @app.get("/visit")
@@ -507,7 +853,7 @@ async def log_visit(request: Request):
         logger.info(f"收到訪問請求: device_id={device_id}, user_name={user_name}")
 
         # 記錄用戶活動
-        await log_user_activity(
+        log_user_activity(
             request,
             "visit",
             {
@@ -515,7 +861,7 @@ async def log_visit(request: Request):
                 "user_name": user_name,
                 "path": str(request.url.path),
                 "method": request.method,
-                "headers": dict(request.headers),
+                "headers": {name: request.headers[name] for name in VISIT_HEADERS if name in request.headers},
             },
         )
 
@@ -533,7 +879,7 @@ async def log_visit(request: Request):
 async def log_action(action: UserAction, request: Request):
     """記錄使用者行為"""
     try:
-        await log_user_activity(
+        log_user_activity(
             request,
             action.action,
             {"device_id": action.device_id, "user_name": action.user_name, "details": action.details},
@@ -562,33 +908,94 @@ async def startup_event():
             print(f"路由：{route.path}, 方法：{route.methods}")
     print("==================\n")
 
-    # 檢查並載入新文件或更新的文件
-    docs_dir = "docs"
-    loaded_docs = set()
+    # 啟動活動記錄的背景寫入
+    activity_log.start()
+
+    # 在背景載入 RAG 系統並同步文件目錄；lazy 為 false 時等待載入完成才開始接受請求
+    rag_loader.start()
+
+    # 定期清除孤立區塊
+    global purge_task
+    purge_interval = config.get("ingestion", {}).get("orphan_purge_interval", 3600)
+    if purge_interval > 0:
+        purge_task = asyncio.create_task(purge_orphans_periodically(purge_interval))
+
+    # 多 worker 部署時定期重建詞彙索引，各 worker 的詞彙索引只含自己匯入的變更
+    global lexical_refresh_task
+    retrieval_config = config.get("retrieval", {})
+    refresh_interval = retrieval_config.get("lexical_refresh_interval", 300)
+    if config["server"].get("workers", 1) > 1 and retrieval_config.get("hybrid", False) and refresh_interval > 0:
+        lexical_refresh_task = asyncio.create_task(refresh_lexical_periodically(refresh_interval))
+
+    # 定期清除過期的轉換結果
+    global output_cleanup_task
+    convert_config = config.get("convert", {})
+    output_ttl = convert_config.get("output_ttl", 86400)
+    if output_ttl > 0:
+        output_cleanup_task = asyncio.create_task(
+            cleanup_output_periodically(output_ttl, convert_config.get("output_cleanup_interval", 3600))
+        )
+
+    if not startup_config.get("lazy", True):
+        try:
+            await rag_loader.aget()
+        except RuntimeError as e:
+            print(f"載入 RAG 系統時發生錯誤：{str(e)}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """服務關閉時等待背景工作結束，並寫入剩餘的活動記錄與追蹤"""
+    for task in (purge_task, lexical_refresh_task, output_cleanup_task):
+        if task is not None:
+            task.cancel()
+    await asyncio.to_thread(ingestion_jobs.shutdown)
+    await asyncio.to_thread(convert_jobs.shutdown)
+    await activity_log.stop()
+    shutdown_tracing()
+
+
+@app.get("/output/{filename}")
+async def download_output(filename: str):
+    """下載轉換結果，CSV、Excel 與純文字檔在第一次下載時產生"""
+    if filename != os.path.basename(filename) or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="檔案不存在")
     try:
-        # 取得已載入的文件列表
-        results = rag_system.collection.get()
-        if results and results["metadatas"]:
-            for metadata in results["metadatas"]:
-                if "source" in metadata:
-                    loaded_docs.add(metadata["source"])
+        path = await asyncio.to_thread(get_export, filename)
     except Exception as e:
-        print(f"取得已載入文件列表時發生錯誤：{str(e)}")
+        logger.error(f"產生轉換結果檔案失敗：{str(e)}")
+        raise HTTPException(status_code=500, detail=f"產生檔案失敗：{str(e)}")
+    if path is None:
+        raise HTTPException(status_code=404, detail="檔案不存在")
+    return FileResponse(path, filename=filename)
 
-    # 檢查並載入新文件
-    for filename in os.listdir(docs_dir):
-        if any(filename.endswith(ext) for ext in config["upload"]["allowed_extensions"]):
-            try:
-                file_path = os.path.join(docs_dir, filename)
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-                    rag_system.add_document(text, {"source": filename})
-                    if filename not in loaded_docs:
-                        print(f"載入新文件：{filename}")
-            except Exception as e:
-                print(f"載入文件 {filename} 時發生錯誤：{str(e)}")
+
+# 掛載靜態文件（放在所有 API 路由之後，避免根路徑掛載遮蔽路由）
+app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/docs", StaticFiles(directory="docs"), name="docs")
+
+# 掛載根路徑的 HTML 檔案
+app.mount("/", StaticFiles(directory="static", html=True), name="html")
 
 
 if __name__ == "__main__":
     # 啟動伺服器
-    uvicorn.run(app, host=config["server"]["host"], port=config["server"]["port"])
+    workers = config["server"].get("workers", 1)
+    service_enabled = config.get("embedding_service", {}).get("enabled", False)
+    if service_enabled:
+        # 嵌入服務在獨立行程中載入模型，所有 worker 共用；啟用時不論 worker 數都需由此啟動
+        import multiprocessing
+        from .embedding_service import run as run_embedding_service
+
+        service = multiprocessing.get_context("spawn").Process(
+            target=run_embedding_service, args=(config,), name="embedding-service", daemon=True
+        )
+        service.start()
+    if workers > 1:
+        if config.get("vector_store", {}).get("backend", "chroma") == "local":
+            print("警告：本機向量索引由各 worker 分別載入，多 worker 部署請改用 ChromaDB")
+        if not service_enabled:
+            print("警告：未啟用 embedding_service，各 worker 分別載入嵌入模型並停用磁碟上的嵌入快取")
+        uvicorn.run("src.server:app", host=config["server"]["host"], port=config["server"]["port"], workers=workers)
+    else:
+        uvicorn.run(app, host=config["server"]["host"], port=config["server"]["port"])
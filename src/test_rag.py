@@ -1,5 +1,5 @@
 import os
-from improved_rag_system import ImprovedRAGSystem
+from .improved_rag_system import ImprovedRAGSystem
 
 def load_documents(docs_dir):
     documents = []
@@ -0,0 +1,146 @@
+from typing import Any, Callable, Dict, Iterator, Optional
+import os
+import sys
+import atexit
+import inspect
+import functools
+from contextlib import contextmanager
+from loguru import logger
+
+try:
+    from opentelemetry import trace
+except ImportError:  # 選用相依套件，未安裝時追蹤為空操作
+    trace = None
+
+_tracer = trace.get_tracer("rag_system") if trace is not None else None
+# setup_tracing 建立的 provider 與追蹤檔，由 shutdown_tracing 關閉
+_provider: Optional[Any] = None
+_trace_file: Optional[Any] = None
+
+
+def setup_tracing(app: Any, config: Dict[str, Any]) -> bool:
+    """
+    依設定啟用 OpenTelemetry 追蹤，並為 FastAPI 請求建立根 span
+
+    exporter 為 console 時輸出到標準輸出；為 file 時以每行一個 span 的 JSON
+    格式寫入檔案，不需連線任何收集器。
+
+    Args:
+        app: FastAPI 應用
+        config: 系統設定
+
+    Returns:
+        是否已啟用追蹤
+    """
+    global _provider, _trace_file
+    tracing_config = config.get("tracing", {})
+    if not tracing_config.get("enabled", False):
+        return False
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    except ImportError as e:
+        logger.warning(f"未安裝 OpenTelemetry SDK，停用追蹤：{str(e)}")
+        return False
+
+    exporter_type = tracing_config.get("exporter", "file")
+    if exporter_type == "file":
+        path = tracing_config.get("path", "logs/traces.jsonl")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        _trace_file = open(path, "a", encoding="utf-8")
+        exporter = ConsoleSpanExporter(out=_trace_file, formatter=lambda span: span.to_json(indent=None) + "\n")
+    elif exporter_type == "console":
+        exporter = ConsoleSpanExporter(out=sys.stdout)
+    else:
+        raise ValueError(f"不支援的追蹤輸出方式：{exporter_type}（可用：console、file）")
+
+    # 由 shutdown_tracing 結束，確保先寫出剩餘的 span 再關閉追蹤檔
+    provider = TracerProvider(resource=Resource.create({
+        "service.name": tracing_config.get("service_name", "rag-system")
+    }), shutdown_on_exit=False)
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    _provider = provider
+    # 未經過服務關閉流程就結束行程時仍會執行；shutdown_tracing 可重複呼叫
+    atexit.register(shutdown_tracing)
+    FastAPIInstrumentor.instrument_app(
+        app,
+        tracer_provider=provider,
+        excluded_urls=",".join(tracing_config.get("excluded_urls", ["/health", "/metrics", "/static"]))
+    )
+    logger.info(f"已啟用 OpenTelemetry 追蹤（{exporter_type}）")
+    return True
+
+
+def shutdown_tracing() -> None:
+    """寫出尚未輸出的 span 並關閉追蹤檔，未啟用追蹤時不做任何事"""
+    global _provider, _trace_file
+    if _provider is not None:
+        _provider.shutdown()
+        _provider = None
+    if _trace_file is not None:
+        _trace_file.close()
+        _trace_file = None
+
+
+@contextmanager
+def span(name: str, current: bool = True, **attributes: Any) -> Iterator[Optional[Any]]:
+    """
+    建立子 span；未安裝 OpenTelemetry 時不做任何事
+
+    Args:
+        name: span 名稱
+        current: 是否設為目前的 span；跨越 yield 的非同步產生器需設為 False，
+            避免在其他工作中恢復執行時無法還原 context
+        attributes: span 屬性
+    """
+    if _tracer is None:
+        yield None
+        return
+    if current:
+        with _tracer.start_as_current_span(name, attributes=attributes or None) as active:
+            yield active
+        return
+    detached = _tracer.start_span(name, attributes=attributes or None)
+    try:
+        yield detached
+    except GeneratorExit:
+        raise
+    except BaseException as e:
+        detached.record_exception(e)
+        detached.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
+        raise
+    finally:
+        detached.end()
+
+
+def traced(name: str) -> Callable:
+    """
+    以裝飾器為函式建立 span，支援一般函式、協程與非同步產生器
+
+    Args:
+        name: span 名稱
+    """
+    def decorator(fn: Callable) -> Callable:
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def async_gen_wrapper(*args, **kwargs):
+                with span(name, current=False):
+                    async for item in fn(*args, **kwargs):
+                        yield item
+            return async_gen_wrapper
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
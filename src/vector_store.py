@@ -0,0 +1,541 @@
+from typing import Any, Dict, Iterator, List, Optional
+import os
+import json
+import asyncio
+import threading
+from contextlib import contextmanager
+import numpy as np
+from loguru import logger
+
+try:
+    import hnswlib
+except ImportError:  # 選用相依套件，未安裝時只提供暴力搜尋
+    hnswlib = None
+
+
+def _match_where(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """判斷元資料是否符合 ChromaDB 風格的 where 條件"""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_match_where(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(_match_where(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, operand in condition.items():
+                if op == "$eq" and value != operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+STORAGE_DTYPES = ("float32", "float16", "int8")
+
+# 非 float32 儲存時每次轉換並計算內積的列數，緩衝區約數 MB，可留在快取中
+_BLOCK_ROWS = 2048
+
+
+class LocalVectorStore:
+    """
+    行程內的向量索引，提供與 ChromaDB Collection 相同的常用介面
+
+    向量以正規化的連續 float32 矩陣保存，小型語料以向量化內積取 top-k；
+    語料超過 hnsw_min_size 且已安裝 hnswlib 時改用 HNSW 近似搜尋；HNSW 以固定的
+    標籤識別向量，新增、更新與刪除時增量更新（刪除以 mark_deleted 標記），
+    並與索引一起保存，重新啟動時直接載入。
+    索引以 .npy（載入時記憶體映射）與 JSON 檔持久化，每次保存都會重寫整個索引；
+    在 batch() 區塊內的變更只於區塊結束時保存一次。距離與 ChromaDB 預設的
+    l2 空間一致（平方歐氏距離）。
+
+    storage_dtype 可改為 float16 或 int8（每個向量一個縮放係數）以減少記憶體與
+    磁碟用量，搜尋時逐塊轉為 float32 計算內積。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        name: str,
+        index: str = "flat",
+        hnsw_min_size: int = 5000,
+        storage_dtype: str = "float32"
+    ):
+        """
+        初始化本機向量索引
+
+        Args:
+            path: 索引根目錄
+            name: 集合名稱
+            index: 索引類型（flat / hnsw）
+            hnsw_min_size: 使用 HNSW 的最小向量數
+            storage_dtype: 向量儲存型別（float32 / float16 / int8）
+        """
+        if storage_dtype not in STORAGE_DTYPES:
+            raise ValueError(f"不支援的向量儲存型別：{storage_dtype}（可用：{', '.join(STORAGE_DTYPES)}）")
+        self.name = name
+        self.storage_dtype = storage_dtype
+        self.index_type = index
+        self.hnsw_min_size = hnsw_min_size
+        self.directory = os.path.join(path, name)
+        self.vectors_path = os.path.join(self.directory, "vectors.npy")
+        self.scales_path = os.path.join(self.directory, "scales.npy")
+        self.records_path = os.path.join(self.directory, "records.json")
+        self.hnsw_path = os.path.join(self.directory, "hnsw.bin")
+        self.hnsw_info_path = os.path.join(self.directory, "hnsw.json")
+        self._lock = threading.RLock()
+
+        self.metadata: Dict[str, Any] = {"description": "Document collection for RAG"}
+        self._ids: List[str] = []
+        self._documents: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._vectors: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None  # int8 儲存時每個向量的縮放係數
+        self._rows: Dict[str, int] = {}
+        # HNSW 使用的固定標籤：刪除後列索引會變動，標籤不會
+        self._labels: List[int] = []
+        self._label_rows: Dict[int, int] = {}
+        self._next_label = 0
+        self._version = 0  # 每次保存遞增，用來確認 hnsw.bin 與索引內容一致
+        self._hnsw = None
+        self._hnsw_deleted = 0  # HNSW 中已標記刪除的數量
+        self._batch_depth = 0  # 巢狀 batch() 的層數，大於 0 時延後保存
+        self._dirty = False  # 是否有尚未保存的變更
+
+        if index == "hnsw" and hnswlib is None:
+            logger.warning("未安裝 hnswlib，本機向量索引改用暴力搜尋")
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        """從磁碟載入索引，向量以唯讀記憶體映射方式開啟"""
+        if not os.path.exists(self.records_path):
+            logger.info(f"建立新的本機向量索引：{self.directory}")
+            return
+        with open(self.records_path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        self.metadata = records.get("metadata", self.metadata)
+        self._ids = records["ids"]
+        self._documents = records["documents"]
+        self._metadatas = records["metadatas"]
+        self._labels = records.get("labels", list(range(len(self._ids))))
+        self._next_label = records.get("next_label", len(self._ids))
+        self._version = records.get("version", 0)
+        if not self._ids:
+            return
+        self._vectors = np.load(self.vectors_path, mmap_mode='r')
+        if records.get("storage_dtype", "float32") == "int8":
+            self._scales = np.load(self.scales_path, mmap_mode='r')
+        self._reindex_rows()
+        logger.info(f"載入本機向量索引：{self.directory}（{len(self._ids)} 個向量）")
+
+        stored_dtype = records.get("storage_dtype", "float32")
+        if stored_dtype != self.storage_dtype:
+            # 儲存型別變更時轉換既有向量
+            logger.info(f"轉換向量儲存型別：{stored_dtype} -> {self.storage_dtype}")
+            self._vectors, self._scales = self._encode(self._decode())
+            self._save()
+
+    def _reindex_rows(self) -> None:
+        self._rows = {chunk_id: i for i, chunk_id in enumerate(self._ids)}
+        self._label_rows = {label: i for i, label in enumerate(self._labels)}
+
+    def _save(self) -> None:
+        """以先寫入暫存檔再取代的方式保存索引"""
+        self._version += 1
+        records = {
+            "metadata": self.metadata,
+            "storage_dtype": self.storage_dtype,
+            "version": self._version,
+            "next_label": self._next_label,
+            "ids": self._ids,
+            "labels": self._labels,
+            "documents": self._documents,
+            "metadatas": self._metadatas,
+        }
+        tmp_records = f"{self.records_path}.tmp"
+        with open(tmp_records, 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False)
+        if self._vectors is not None:
+            tmp_vectors = f"{self.vectors_path}.tmp"
+            with open(tmp_vectors, 'wb') as f:
+                np.save(f, np.ascontiguousarray(self._vectors))
+            os.replace(tmp_vectors, self.vectors_path)
+        elif os.path.exists(self.vectors_path):
+            # 全部刪除後移除舊的向量檔
+            os.remove(self.vectors_path)
+        if self._scales is not None:
+            tmp_scales = f"{self.scales_path}.tmp"
+            with open(tmp_scales, 'wb') as f:
+                np.save(f, np.ascontiguousarray(self._scales))
+            os.replace(tmp_scales, self.scales_path)
+        self._save_hnsw()
+        os.replace(tmp_records, self.records_path)
+
+    def _changed(self) -> None:
+        """記錄變更；不在 batch() 區塊內時立即保存"""
+        self._dirty = True
+        if self._batch_depth == 0:
+            self.persist()
+
+    def persist(self) -> None:
+        """將尚未保存的變更寫入磁碟"""
+        with self._lock:
+            if self._dirty:
+                self._save()
+                self._dirty = False
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """區塊內的新增、更新與刪除只在最外層區塊結束時寫入磁碟一次"""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self.persist()
+
+    def _save_hnsw(self) -> None:
+        """保存 HNSW 索引並記錄對應的索引版本；沒有 HNSW 時移除版本資訊，避免載入過期的檔案"""
+        if self._hnsw is None:
+            if os.path.exists(self.hnsw_info_path):
+                os.remove(self.hnsw_info_path)
+            return
+        tmp_hnsw = f"{self.hnsw_path}.tmp"
+        self._hnsw.save_index(tmp_hnsw)
+        os.replace(tmp_hnsw, self.hnsw_path)
+        with open(self.hnsw_info_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": self._version, "deleted": self._hnsw_deleted}, f)
+
+    def _writable_vectors(self) -> Optional[np.ndarray]:
+        """寫入前將記憶體映射的向量複製為可寫入的陣列"""
+        if isinstance(self._vectors, np.memmap):
+            self._vectors = np.array(self._vectors)
+        if isinstance(self._scales, np.memmap):
+            self._scales = np.array(self._scales)
+        return self._vectors
+
+    def _encode(self, vectors: np.ndarray) -> tuple:
+        """將 float32 向量轉為儲存型別，回傳 (向量, 縮放係數)"""
+        if self.storage_dtype == "float16":
+            return vectors.astype(np.float16), None
+        if self.storage_dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            quantized = np.rint(vectors / scales[:, None]).astype(np.int8)
+            return quantized, scales.astype(np.float32)
+        return np.ascontiguousarray(vectors, dtype=np.float32), None
+
+    def _decode(self, rows: Any = None) -> np.ndarray:
+        """將儲存的向量還原為 float32"""
+        vectors = self._vectors if rows is None else self._vectors[rows]
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self._scales is not None:
+            scales = self._scales if rows is None else self._scales[rows]
+            vectors = vectors * np.asarray(scales, dtype=np.float32)[:, None]
+        return vectors
+
+    @staticmethod
+    def _normalize(embeddings: Any) -> np.ndarray:
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _select_rows(self, ids: Optional[List[str]], where: Optional[Dict[str, Any]]) -> List[int]:
+        """依 ID 與 where 條件選出列索引"""
+        if ids is not None:
+            rows = [self._rows[chunk_id] for chunk_id in ids if chunk_id in self._rows]
+        else:
+            rows = range(len(self._ids))
+        return [row for row in rows if _match_where(self._metadatas[row], where)]
+
+    def _format(self, rows: List[int], include: List[str]) -> Dict[str, Any]:
+        """將列索引轉換為 ChromaDB 格式的結果"""
+        return {
+            "ids": [self._ids[row] for row in rows],
+            "documents": [self._documents[row] for row in rows] if "documents" in include else None,
+            "metadatas": [dict(self._metadatas[row]) for row in rows] if "metadatas" in include else None,
+            "embeddings": self._decode(rows) if "embeddings" in include and self._vectors is not None else None,
+        }
+
+    def count(self) -> int:
+        """回傳向量數"""
+        return len(self._ids)
+
+    def modify(self, metadata: Optional[Dict[str, Any]] = None, **kwargs) -> None:
+        """更新集合元資料"""
+        with self._lock:
+            if metadata is not None:
+                self.metadata = dict(metadata)
+                self._changed()
+
+    def reset(self, metadata: Optional[Dict[str, Any]] = None) -> None:
+        """
+        清空集合並重設元資料，相當於刪除後重新建立 ChromaDB 集合；向量維度改由下一次新增決定
+
+        Args:
+            metadata: 新的集合元資料，未提供時沿用原本的元資料
+        """
+        with self._lock:
+            if metadata is not None:
+                self.metadata = dict(metadata)
+            self._ids, self._documents, self._metadatas, self._labels = [], [], [], []
+            self._vectors = None
+            self._scales = None
+            self._hnsw = None
+            self._hnsw_deleted = 0
+            self._reindex_rows()
+            self._changed()
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """依 ID 或元資料條件取得項目"""
+        include = ["metadatas", "documents"] if include is None else include
+        with self._lock:
+            rows = self._select_rows(ids, where)
+            start = offset or 0
+            rows = rows[start:start + limit] if limit is not None else rows[start:]
+            return self._format(rows, include)
+
+    def add(
+        self,
+        ids: List[str],
+        embeddings: Any,
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None
+    ) -> None:
+        """新增項目，已存在的 ID 會被略過"""
+        vectors = self._normalize(embeddings)
+        documents = documents if documents is not None else [""] * len(ids)
+        metadatas = metadatas if metadatas is not None else [{}] * len(ids)
+        with self._lock:
+            keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in self._rows]
+            if len(keep) < len(ids):
+                logger.warning(f"略過 {len(ids) - len(keep)} 個已存在的 ID")
+            if not keep:
+                return
+            if self._vectors is not None and vectors.shape[1] != self._vectors.shape[1]:
+                raise ValueError(f"向量維度 {vectors.shape[1]} 與集合的維度 {self._vectors.shape[1]} 不符")
+            start = len(self._ids)
+            labels = list(range(self._next_label, self._next_label + len(keep)))
+            self._next_label += len(keep)
+            for offset, i in enumerate(keep):
+                self._ids.append(ids[i])
+                self._documents.append(documents[i])
+                self._metadatas.append(dict(metadatas[i]))
+                self._labels.append(labels[offset])
+                self._rows[ids[i]] = start + offset
+                self._label_rows[labels[offset]] = start + offset
+            existing = self._writable_vectors()
+            encoded, scales = self._encode(vectors[keep])
+            self._vectors = encoded if existing is None else np.vstack([existing, encoded])
+            if scales is not None:
+                self._scales = scales if existing is None else np.concatenate([self._scales, scales])
+            self._hnsw_add(labels, vectors[keep])
+            self._changed()
+
+    def update(
+        self,
+        ids: List[str],
+        embeddings: Any = None,
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None
+    ) -> None:
+        """更新既有項目的向量、文字或元資料"""
+        with self._lock:
+            rows = [self._rows.get(chunk_id) for chunk_id in ids]
+            if embeddings is not None:
+                vectors = self._normalize(embeddings)
+                encoded, scales = self._encode(vectors)
+                writable = self._writable_vectors()
+                for i, row in enumerate(rows):
+                    if row is not None:
+                        writable[row] = encoded[i]
+                        if scales is not None:
+                            self._scales[row] = scales[i]
+                # hnswlib 對已存在的標籤會更新向量
+                updated = [i for i, row in enumerate(rows) if row is not None]
+                self._hnsw_add([self._labels[rows[i]] for i in updated], vectors[updated])
+            for i, row in enumerate(rows):
+                if row is None:
+                    continue
+                if documents is not None:
+                    self._documents[row] = documents[i]
+                if metadatas is not None:
+                    self._metadatas[row].update(metadatas[i])
+            self._changed()
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None) -> None:
+        """依 ID 或元資料條件刪除項目"""
+        with self._lock:
+            if ids is None and where is None:
+                return
+            remove = set(self._select_rows(ids, where))
+            if not remove:
+                return
+            keep = [row for row in range(len(self._ids)) if row not in remove]
+            self._hnsw_delete([self._labels[row] for row in remove])
+            self._ids = [self._ids[row] for row in keep]
+            self._labels = [self._labels[row] for row in keep]
+            self._documents = [self._documents[row] for row in keep]
+            self._metadatas = [self._metadatas[row] for row in keep]
+            self._vectors = np.array(self._vectors[keep]) if keep else None
+            if self._scales is not None:
+                self._scales = np.array(self._scales[keep]) if keep else None
+            self._reindex_rows()
+            self._changed()
+
+    def _use_hnsw(self) -> bool:
+        return self.index_type == "hnsw" and hnswlib is not None and len(self._ids) >= self.hnsw_min_size
+
+    def _hnsw_add(self, labels: List[int], vectors: np.ndarray) -> None:
+        """將新增或更新的向量寫入已建立的 HNSW 索引"""
+        if self._hnsw is None or not labels:
+            return
+        needed = self._hnsw.get_current_count() + len(labels)
+        if needed > self._hnsw.get_max_elements():
+            self._hnsw.resize_index(max(needed, 2 * self._hnsw.get_max_elements()))
+        self._hnsw.add_items(vectors, np.asarray(labels, dtype=np.int64))
+
+    def _hnsw_delete(self, labels: List[int]) -> None:
+        """在 HNSW 索引中標記刪除；標記數超過現有向量數時捨棄索引，下次查詢時重建"""
+        if self._hnsw is None:
+            return
+        for label in labels:
+            self._hnsw.mark_deleted(label)
+        self._hnsw_deleted += len(labels)
+        if self._hnsw_deleted > len(self._ids) - len(labels):
+            self._hnsw = None
+            self._hnsw_deleted = 0
+
+    def _get_hnsw(self) -> Any:
+        """取得 HNSW 索引：優先載入與目前索引版本一致的檔案，否則重新建立"""
+        if self._hnsw is not None:
+            return self._hnsw
+        dim = self._vectors.shape[1]
+        index = hnswlib.Index(space='ip', dim=dim)
+        info = None
+        if os.path.exists(self.hnsw_info_path) and os.path.exists(self.hnsw_path):
+            with open(self.hnsw_info_path, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        if info is not None and info.get("version") == self._version:
+            logger.info(f"載入 HNSW 索引：{self.hnsw_path}")
+            index.load_index(self.hnsw_path, max_elements=len(self._ids) + info.get("deleted", 0))
+            self._hnsw_deleted = info.get("deleted", 0)
+        else:
+            logger.info(f"建立 HNSW 索引（{len(self._ids)} 個向量）")
+            index.init_index(max_elements=len(self._ids), ef_construction=200, M=16)
+            index.add_items(self._decode(), np.asarray(self._labels, dtype=np.int64))
+            self._hnsw_deleted = 0
+        index.set_ef(100)
+        self._hnsw = index
+        # 有尚未保存的變更時，HNSW 索引隨下一次保存一併寫入，避免與磁碟上的索引版本不符
+        if (info is None or info.get("version") != self._version) and not self._dirty:
+            self._save_hnsw()
+        return index
+
+    def query(
+        self,
+        query_embeddings: Any,
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None,
+        include: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """以向量查詢最相近的項目"""
+        include = ["metadatas", "documents", "distances"] if include is None else include
+        queries = self._normalize(query_embeddings)
+        result: Dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": None}
+        with self._lock:
+            candidates = None if not where else np.array(self._select_rows(None, where), dtype=np.int64)
+            for query_vector in queries:
+                rows, scores = self._search(query_vector, n_results, candidates)
+                formatted = self._format(rows, include)
+                result["ids"].append(formatted["ids"])
+                result["documents"].append(formatted["documents"])
+                result["metadatas"].append(formatted["metadatas"])
+                # 正規化向量的平方歐氏距離 = 2 - 2 × 內積
+                result["distances"].append((2.0 - 2.0 * scores).tolist())
+        return result
+
+    @staticmethod
+    def _inner_products(matrix: np.ndarray, query_vector: np.ndarray) -> np.ndarray:
+        """
+        計算各向量與查詢向量的內積
+
+        float16 / int8 矩陣逐塊轉換到預先配置的 float32 緩衝區再計算，
+        不建立整個矩陣的 float32 副本
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        if matrix.dtype == np.float32:
+            return np.asarray(matrix @ query_vector, dtype=np.float32)
+        scores = np.empty(len(matrix), dtype=np.float32)
+        buffer = np.empty((min(_BLOCK_ROWS, len(matrix)), matrix.shape[1]), dtype=np.float32)
+        for start in range(0, len(matrix), _BLOCK_ROWS):
+            block = matrix[start:start + _BLOCK_ROWS]
+            converted = buffer[:len(block)]
+            np.copyto(converted, block, casting='unsafe')
+            np.dot(converted, query_vector, out=scores[start:start + len(block)])
+        return scores
+
+    def _search(self, query_vector: np.ndarray, n_results: int, candidates: Optional[np.ndarray]) -> tuple:
+        """回傳 (列索引列表, 內積分數陣列)，依分數由高到低排序"""
+        if self._vectors is None or (candidates is not None and len(candidates) == 0):
+            return [], np.empty(0, dtype=np.float32)
+
+        if candidates is None and self._use_hnsw():
+            k = min(n_results, len(self._ids))
+            labels, distances = self._get_hnsw().knn_query(query_vector, k=k)
+            # hnswlib 的 ip 距離為 1 - 內積；標籤轉回目前的列索引
+            rows = [self._label_rows[label] for label in labels[0].tolist()]
+            return rows, 1.0 - distances[0]
+
+        matrix = self._vectors if candidates is None else self._vectors[candidates]
+        scores = self._inner_products(matrix, query_vector)
+        if self._scales is not None:
+            # int8 向量的內積乘回各向量的縮放係數
+            scales = self._scales if candidates is None else self._scales[candidates]
+            scores *= scales
+        k = min(n_results, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        rows = top if candidates is None else candidates[top]
+        return rows.tolist(), scores[top]
+
+
+class AsyncLocalVectorStore:
+    """將 LocalVectorStore 包裝成與 ChromaDB 非同步集合相同的介面"""
+
+    def __init__(self, store: LocalVectorStore):
+        self._store = store
+
+    async def query(self, **kwargs) -> Dict[str, Any]:
+        # 搜尋需等待寫入時的鎖，也可能首次建立 HNSW，在執行緒中執行以免阻塞事件迴圈
+        return await asyncio.to_thread(self._store.query, **kwargs)
+
+    async def get(self, **kwargs) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._store.get, **kwargs)
+
+    async def count(self) -> int:
+        return self._store.count()
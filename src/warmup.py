@@ -0,0 +1,169 @@
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import os
+import time
+import fcntl
+import asyncio
+import threading
+from contextlib import contextmanager
+from loguru import logger
+
+
+@contextmanager
+def file_lock(path: str, blocking: bool = False) -> Iterator[bool]:
+    """
+    以檔案鎖確保多個 worker 行程中只有一個執行同一項工作
+
+    Args:
+        path: 鎖定檔路徑
+        blocking: 其他行程持有鎖時是否等待其釋放
+
+    Yields:
+        是否取得鎖；不等待時其他行程持有鎖則為 False
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            f.write(str(os.getpid()))
+            f.flush()
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class BackgroundLoader:
+    """
+    在背景執行緒建立耗時的元件，讓服務啟動後立即可以接受請求
+
+    元件建立完成即視為就緒；之後的預熱工作（如同步文件目錄）在同一執行緒中
+    繼續進行，不影響就緒狀態。
+    """
+
+    def __init__(self, factory: Callable[[], Any], warmup: Optional[Callable[[Any], None]] = None, name: str = "loader"):
+        """
+        初始化背景載入器
+
+        Args:
+            factory: 建立元件的函式
+            warmup: 元件建立後執行的預熱函式
+            name: 執行緒名稱
+        """
+        self._factory = factory
+        self._warmup = warmup
+        self._name = name
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        # 等待載入完成的非同步請求：(事件迴圈, future)
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self.value: Any = None
+        self.error: Optional[str] = None
+        self.warmup_status = "pending"  # pending / running / done / failed
+        self.started_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set() and self.error is None
+
+    def start(self) -> None:
+        """啟動背景載入，重複呼叫不會重新載入"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            self.value = self._factory()
+            self.ready_at = time.time()
+            logger.info(f"{self._name} 載入完成，耗時 {self.ready_at - self.started_at:.1f} 秒")
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"{self._name} 載入失敗：{str(e)}")
+            return
+        finally:
+            self._set_ready()
+
+        if self._warmup is None:
+            self.warmup_status = "done"
+            return
+        self.warmup_status = "running"
+        try:
+            self._warmup(self.value)
+            self.warmup_status = "done"
+        except Exception as e:
+            self.warmup_status = "failed"
+            logger.error(f"{self._name} 預熱失敗：{str(e)}")
+
+    def _set_ready(self) -> None:
+        """標記載入結束，並喚醒等待中的非同步請求"""
+        with self._lock:
+            self._ready.set()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                # 事件迴圈已關閉
+                pass
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """
+        取得元件，尚未載入完成時最多等待 timeout 秒
+
+        Raises:
+            TimeoutError: 等待逾時
+            RuntimeError: 載入失敗
+        """
+        if not self._ready.wait(timeout):
+            raise TimeoutError(f"{self._name} 尚未載入完成")
+        if self.error is not None:
+            raise RuntimeError(f"{self._name} 載入失敗：{self.error}")
+        return self.value
+
+    async def aget(self, timeout: Optional[float] = None) -> Any:
+        """get 的非同步版本，以事件迴圈上的 future 等待，不佔用執行緒"""
+        if not self._ready.is_set():
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            with self._lock:
+                waiting = not self._ready.is_set()
+                if waiting:
+                    self._waiters.append((loop, future))
+            if waiting:
+                try:
+                    await asyncio.wait_for(future, timeout)
+                except asyncio.TimeoutError:
+                    with self._lock:
+                        if (loop, future) in self._waiters:
+                            self._waiters.remove((loop, future))
+        return self.get(timeout=0)
+
+    def status(self) -> Dict[str, Any]:
+        """回傳載入狀態"""
+        if self.error is not None:
+            state = "failed"
+        elif self._ready.is_set():
+            state = "ready"
+        elif self._thread is not None:
+            state = "loading"
+        else:
+            state = "pending"
+        return {
+            "state": state,
+            "error": self.error,
+            "warmup": self.warmup_status,
+            "load_seconds": self.ready_at - self.started_at if self.ready_at and self.started_at else None,
+        }
@@ -206,6 +206,64 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         },
 
+        // 以 Server-Sent Events 串流查詢，依序觸發 onSources 與 onToken
+        async queryStream(question, similarity, { onSources, onToken }) {
+            const response = await fetch('./query/stream', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    text: question,
+                    similarity_threshold: similarity
+                })
+            });
+            if (!response.ok || !response.body) {
+                const errorText = await response.text();
+                console.error('查詢失敗，伺服器回應:', errorText);
+                throw new Error(errorText);
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) {
+                    break;
+                }
+                buffer += decoder.decode(value, { stream: true });
+
+                // 每個事件以空行分隔
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+
+                    let eventName = 'message';
+                    let data = '';
+                    rawEvent.split('\n').forEach(line => {
+                        if (line.startsWith('event:')) {
+                            eventName = line.slice(6).trim();
+                        } else if (line.startsWith('data:')) {
+                            data += line.slice(5).trim();
+                        }
+                    });
+                    const payload = data ? JSON.parse(data) : {};
+
+                    if (eventName === 'sources' && onSources) {
+                        onSources(payload.sources, payload.enhanced_prompt);
+                    } else if (eventName === 'token' && onToken) {
+                        onToken(payload.text);
+                    } else if (eventName === 'error') {
+                        throw new Error(payload.message);
+                    } else if (eventName === 'done') {
+                        return;
+                    }
+                }
+            }
+        },
+
         async getDocuments() {
             try {
                 const response = await fetch('./documents');
@@ -266,6 +324,31 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         },
 
+        async getJob(jobId) {
+            const response = await fetch(`./jobs/${encodeURIComponent(jobId)}`);
+            if (!response.ok) {
+                throw new Error(await response.text());
+            }
+            return await response.json();
+        },
+
+        // 輪詢背景工作直到完成
+        async waitForJob(jobId, onProgress, interval = 1000) {
+            while (true) {
+                const job = await this.getJob(jobId);
+                if (job.status === 'done') {
+                    return job;
+                }
+                if (job.status === 'failed') {
+                    throw new Error(job.error || '背景工作失敗');
+                }
+                if (onProgress) {
+                    onProgress(job);
+                }
+                await new Promise(resolve => setTimeout(resolve, interval));
+            }
+        },
+
         async uploadDocument(file) {
             return new Promise((resolve, reject) => {
                 showUploadModal();
@@ -574,8 +657,23 @@ document.addEventListener('DOMContentLoaded', () => {
 
         try {
             ui.showLoading();
-            const result = await api.query(question, similarity);
-            ui.showAnswer(result.answer, result.sources, result.enhanced_prompt);
+
+            // 先顯示來源，再隨著串流逐步更新答案
+            let answer = '';
+            let sources = [];
+            let enhancedPrompt = '';
+            await api.queryStream(question, similarity, {
+                onSources: (streamSources, streamPrompt) => {
+                    sources = streamSources;
+                    enhancedPrompt = streamPrompt;
+                    ui.hideLoading();
+                    ui.showAnswer(answer, sources, enhancedPrompt);
+                },
+                onToken: (text) => {
+                    answer += text;
+                    ui.showAnswer(answer, sources, enhancedPrompt);
+                }
+            });
             
             // 記錄查詢行為
             fetch('./log_action', {
@@ -844,7 +942,15 @@ document.addEventListener('DOMContentLoaded', () => {
     async function handleFileUpload(file) {
         try {
             showToast('正在上傳文本...', 'info');
-            await api.uploadDocument(file);
+            const result = await api.uploadDocument(file);
+            if (result.job_id) {
+                showToast('文本已上傳，正在建立索引...', 'info');
+                await api.waitForJob(result.job_id, (job) => {
+                    if (job.total > 0) {
+                        showToast(`正在建立索引：${job.progress}/${job.total} 個區塊`, 'info');
+                    }
+                });
+            }
             showToast('文本上傳成功！', 'success');
             
             // 刷新文本列表
@@ -1004,7 +1110,11 @@ document.addEventListener('DOMContentLoaded', () => {
                 
                 // 使用現有的 API 方法上傳文件
                 try {
-                    await api.uploadDocument(file);
+                    const result = await api.uploadDocument(file);
+                    if (result.job_id) {
+                        showToast('文本已上傳，正在建立索引...', 'info');
+                        await api.waitForJob(result.job_id);
+                    }
                     
                     // 顯示成功提示
                     showToast('文本上傳成功！', 'success');
@@ -114,10 +114,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
             if (!response.ok) {
                 const error = await response.json();
-                throw new Error(error.error || '處理文件時發生錯誤');
+                throw new Error(error.error || error.detail || '處理文件時發生錯誤');
             }
 
-            const result = await response.json();
+            // 轉換在背景進行，輪詢工作狀態直到完成
+            const { job_id } = await response.json();
+            const result = await waitForJob(job_id);
             showResults(result);
             showToast('文件處理成功！', 'success');
             
@@ -129,6 +131,28 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    async function waitForJob(jobId) {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+
+            const response = await fetch(`./convert/jobs/${jobId}`);
+            if (!response.ok) {
+                throw new Error('查詢轉換進度失敗');
+            }
+
+            const job = await response.json();
+            if (job.status === 'done') {
+                return job.result;
+            }
+            if (job.status === 'failed') {
+                throw new Error(job.error || '處理文件時發生錯誤');
+            }
+            if (job.total > 0) {
+                showToast(`正在處理文件...（${job.progress}/${job.total}）`, 'info');
+            }
+        }
+    }
+
     function resetFileSelection() {
         state.selectedFile = null;
         elements.selectedFileName.classList.add('hidden');